@@ -0,0 +1,44 @@
+# backend/ai_integration/_inflight.py
+import asyncio
+from typing import Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+class InFlight:
+    """
+    Coalesces concurrent identical calls.
+
+    While a call for a key is running, later callers with the same key wait for its
+    result instead of starting their own, so a burst of identical prompts costs one
+    Gemini request. Nothing is kept once the call finishes; that is the LLM cache's job.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """
+        Returns the result of factory(), sharing one running call per key.
+
+        Parameters:
+          - key: Identifies identical calls, e.g. an LLMCache key.
+          - factory: Starts the call; only invoked if no call for key is running.
+
+        Returns:
+          - The call's result (or raises its exception) for every caller.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        # A caller that is cancelled (e.g. the client disconnected) must not cancel the
+        # call for the others still waiting on it
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Mark the exception as retrieved even if every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
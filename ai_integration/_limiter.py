@@ -0,0 +1,70 @@
+# backend/ai_integration/_limiter.py
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+class TokenBucket:
+    """
+    Cost-aware rate limiter for Gemini calls.
+
+    Each call consumes one request plus its estimated token count, so a long prompt
+    uses up more of the per-minute budget than a greeting. Both buckets refill
+    continuously. A concurrency cap bounds the number of in-flight calls.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, max_concurrency: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        # Guards the bucket state; never held across an await or a sleep
+        self._lock = threading.Lock()
+        self._async_slots = asyncio.Semaphore(max_concurrency)
+        self._sync_slots = threading.Semaphore(max_concurrency)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Takes capacity and returns 0 if available, otherwise returns the seconds to wait."""
+        # A single call larger than the whole bucket would otherwise never fit
+        tokens = min(tokens, self.tokens_per_minute)
+        with self._lock:
+            self._refill()
+            if self._requests >= 1 and self._tokens >= tokens:
+                self._requests -= 1
+                self._tokens -= tokens
+                return 0.0
+            wait_requests = max(0.0, 1 - self._requests) * 60 / self.requests_per_minute
+            wait_tokens = max(0.0, tokens - self._tokens) * 60 / self.tokens_per_minute
+            return max(wait_requests, wait_tokens)
+
+    @asynccontextmanager
+    async def reserve(self, tokens: int):
+        """Waits (without blocking the event loop) until the call fits in the budget."""
+        async with self._async_slots:
+            while True:
+                delay = self._try_acquire(tokens)
+                if not delay:
+                    break
+                await asyncio.sleep(delay)
+            yield
+
+    @contextmanager
+    def reserve_sync(self, tokens: int):
+        """Blocking counterpart of reserve() for synchronous code paths."""
+        with self._sync_slots:
+            while True:
+                delay = self._try_acquire(tokens)
+                if not delay:
+                    break
+                time.sleep(delay)
+            yield
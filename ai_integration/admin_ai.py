@@ -1,11 +1,54 @@
 # backend/ai_integration/admin_ai.py
-import os
-import google.generativeai as genai
+import asyncio
 import json
-import dotenv
-dotenv.load_dotenv()
+import logging
+from typing import List, Optional
+from pydantic import BaseModel
+from ai_integration.gemini import generate, get_model, submit_batch, get_batch_results
+from ai_integration.config import settings
 
-def get_admin_recommendations(financial_data: dict) -> str:
+logger = logging.getLogger(__name__)
+
+SYSTEM_INSTRUCTION = (
+    "You are an AI financial advisor with deep knowledge of business analytics. "
+    "Offer clear insights and recommendations based on the provided data."
+)
+
+# Offline reports can go through the Gemini Batch API at half the real-time price
+ADMIN_AI_BATCH_ENABLED = settings.admin_ai_batch_enabled
+
+# Static instructions sent ahead of every report
+ANALYSIS_PREAMBLE = (
+    "Analyze the following financial and business data and provide actionable insights regarding revenue growth, "
+    "profit optimization, and succession planning strategies:"
+)
+
+class AdminInsights(BaseModel):
+    """Structured analysis returned for one financial report."""
+    revenue_insights: str
+    growth_opportunities: List[str]
+    succession_plan: str
+
+# JSON mode plus a declared schema, so the reply can be validated instead of re-parsed
+STRUCTURED_OUTPUT = {"response_mime_type": "application/json", "response_schema": AdminInsights}
+
+# The same schema in REST form, for Batch API requests
+_BATCH_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "revenue_insights": {"type": "STRING"},
+        "growth_opportunities": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "succession_plan": {"type": "STRING"},
+    },
+    "required": ["revenue_insights", "growth_opportunities", "succession_plan"],
+}
+
+def _build_prompt(financial_data: dict) -> str:
+    # Convert the financial data dict to a nicely formatted JSON string.
+    data_str = json.dumps(financial_data, indent=2)
+    return ANALYSIS_PREAMBLE + "\n\n" + data_str
+
+async def get_admin_recommendations(financial_data: dict) -> AdminInsights:
     """
     Analyzes financial and business data for strategic recommendations.
     
@@ -13,37 +56,111 @@ def get_admin_recommendations(financial_data: dict) -> str:
       - financial_data: A dictionary containing revenue metrics, costs, profit trends, etc.
     
     Returns:
-      - A text output from Gemini offering revenue insights, growth opportunities, and suggestions for succession planning.
+      - An AdminInsights object with revenue insights, growth opportunities, and a succession plan.
     """
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
-        raise Exception("GEMINI_API_KEY environment variable not set.")
+    # The instruction and preamble are far below the minimum size of a Gemini context
+    # cache, so they are sent with each report on the shared model
+    model = get_model("gemini-1.5-pro", SYSTEM_INSTRUCTION, max_output_tokens=600, temperature=0.2, **STRUCTURED_OUTPUT)
     
-    # Convert the financial data dict to a nicely formatted JSON string.
-    data_str = json.dumps(financial_data, indent=2)
+    # Generate the response without blocking the event loop
+    response = await generate(model, _build_prompt(financial_data))
+    return AdminInsights.model_validate_json(response.text)
+
+async def get_admin_recommendations_batch(financial_datas: List[dict]) -> List[AdminInsights]:
+    """
+    Analyzes several financial reports with a single Gemini request.
+    
+    Parameters:
+      - financial_datas: A list of financial data dictionaries (one per report).
+    
+    Returns:
+      - A list of AdminInsights, in the same order as the reports. Falls back to
+        one request per report if the batched reply cannot be parsed.
+    """
+    if not financial_datas:
+        return []
+    
+    reports = "\n\n".join(
+        f"Report {i}:\n{json.dumps(data, indent=2)}" for i, data in enumerate(financial_datas, start=1)
+    )
     prompt = (
-        "Analyze the following financial and business data and provide actionable insights regarding revenue growth, "
-        "profit optimization, and succession planning strategies:\n\n" + data_str
+        "Analyze each of the following financial and business reports independently and provide actionable insights "
+        "regarding revenue growth, profit optimization, and succession planning strategies. "
+        "Return a JSON array with exactly one analysis per report, in order:\n\n" + reports
     )
     
-    system_instruction = (
-        "You are an AI financial advisor with deep knowledge of business analytics. "
-        "Offer clear insights and recommendations based on the provided data."
+    model = get_model(
+        "gemini-1.5-pro",
+        SYSTEM_INSTRUCTION,
+        max_output_tokens=8192,
+        temperature=0.2,
+        response_mime_type="application/json",
+        response_schema=List[AdminInsights]
     )
+    try:
+        response = await generate(model, prompt)
+        insights = json.loads(response.text)
+        if isinstance(insights, list) and len(insights) == len(financial_datas):
+            return [AdminInsights.model_validate(i) for i in insights]
+        logger.warning(
+            "Batched admin reply had %s analyses for %d reports",
+            len(insights) if isinstance(insights, list) else "no", len(financial_datas)
+        )
+    except Exception as e:
+        logger.error("Error in batched admin recommendations: %s", e, exc_info=True)
     
-    # Configure the Gemini API
-    genai.configure(api_key=gemini_api_key)
-    
-    # Set up the model with generation configuration
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-pro",
-        generation_config={
-            "max_output_tokens": 600,
-            "temperature": 0.2,
-        },
-        system_instruction=system_instruction
-    )
+    # Fall back to individual (concurrent) requests
+    return await asyncio.gather(*(get_admin_recommendations(data) for data in financial_datas))
+
+def submit_admin_batch(financial_datas: List[dict]) -> str:
+    """
+    Submits financial analyses to the Gemini Batch API for offline processing
+    (e.g. nightly dashboards). Results are typically ready within 24 hours.
+    
+    Parameters:
+      - financial_datas: A list of financial data dictionaries (one per report).
+    
+    Returns:
+      - The batch id to pass to poll_admin_batch.
+    """
+    if not ADMIN_AI_BATCH_ENABLED:
+        raise Exception("Admin AI batch mode is disabled. Set ADMIN_AI_BATCH_ENABLED to enable it.")
+    
+    requests = [
+        {
+            "contents": [{"role": "user", "parts": [{"text": _build_prompt(data)}]}],
+            "system_instruction": {"parts": [{"text": SYSTEM_INSTRUCTION}]},
+            "generation_config": {
+                "max_output_tokens": 600,
+                "temperature": 0.2,
+                "response_mime_type": "application/json",
+                "response_schema": _BATCH_RESPONSE_SCHEMA,
+            },
+        }
+        for data in financial_datas
+    ]
+    return submit_batch("gemini-1.5-pro", requests, display_name="admin-ai-insights")
+
+def poll_admin_batch(batch_id: str) -> Optional[List[Optional[AdminInsights]]]:
+    """
+    Checks on a batch submitted with submit_admin_batch.
+    
+    Parameters:
+      - batch_id: The id returned by submit_admin_batch.
+    
+    Returns:
+      - None while the batch is still running, otherwise the AdminInsights for each report
+        in submission order (None for reports that failed or returned invalid JSON).
+    """
+    results = get_batch_results(batch_id)
+    if results is None:
+        return None
     
-    # Generate the response
-    response = model.generate_content(prompt)
-    return response.text
+    insights: List[Optional[AdminInsights]] = []
+    for text in results:
+        try:
+            insights.append(AdminInsights.model_validate_json(text) if text else None)
+        except ValueError as e:
+            logger.warning("Invalid admin insights in batch %s: %s", batch_id, e)
+            insights.append(None)
+    return insights
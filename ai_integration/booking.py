@@ -1,24 +1,51 @@
 # backend/ai_integration/booking.py
-import os
+import atexit
 import datetime
-from supabase import create_client, Client
-import dotenv
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
 import uuid
-dotenv.load_dotenv()
+from ai_integration.db import get_async_client
 
-# Initialize Supabase client using environment variables
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY") # Use ANON key
-if not SUPABASE_URL or not SUPABASE_ANON_KEY:
-    raise Exception("Supabase credentials (URL and ANON KEY) not set in environment variables.")
+logger = logging.getLogger(__name__)
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+# Postgres error code raised when the bookings_no_overlap constraint rejects a booking
+EXCLUSION_VIOLATION = "23P01"
 
-def is_mechanic_available(mechanic_id: str, booking_time: datetime.datetime, service_duration: int) -> bool:
+# Chatbot booking flows re-check the same slot several times per turn, so
+# availability answers are kept briefly, keyed by (mechanic_id, start ISO, duration).
+_availability_cache = TTLCache(maxsize=10_000, ttl=30)
+_availability_lock = threading.Lock()
+
+def _invalidate_availability(mechanic_id: str) -> None:
+    """Drops cached availability answers for a mechanic after their bookings change."""
+    with _availability_lock:
+        for key in [k for k in _availability_cache if k[0] == mechanic_id]:
+            _availability_cache.pop(key, None)
+
+def _utc_now_iso() -> str:
+    """Current UTC time as a timezone-aware ISO string (second precision)."""
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+
+def _mock_booking_details(booking_id: str) -> dict:
+    # Mock booking details for demo purposes; one timestamp serves both time fields
+    now = _utc_now_iso()
+    return {
+        "id": booking_id,
+        "user_id": "mock-user",
+        "mechanic_id": "mock-mechanic",
+        "booking_time": now,
+        "service_duration": 60,
+        "status": "pending",
+        "created_at": now
+    }
+
+async def is_mechanic_available(mechanic_id: str, booking_time: datetime.datetime, service_duration: int) -> bool:
     """
     Checks if the mechanic is available at the requested time for the specified duration.
-    This function queries the 'bookings' table for overlapping bookings
-    (ignoring bookings with status 'cancelled' or 'completed').
+    The overlap test runs in Postgres via the 'check_overlap' RPC
+    (see supabase/migrations), ignoring bookings with status 'cancelled' or 'completed'.
     """
     try:
         # Calculate end time for the requested booking
@@ -26,57 +53,85 @@ def is_mechanic_available(mechanic_id: str, booking_time: datetime.datetime, ser
         start_iso = booking_time.isoformat()
         end_iso = end_time.isoformat()
         
-        print(f"Checking availability for mechanic {mechanic_id} at {start_iso} to {end_iso}")
+        cache_key = (mechanic_id, start_iso, service_duration)
+        with _availability_lock:
+            cached = _availability_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        logger.debug("Checking availability for mechanic %s at %s to %s", mechanic_id, start_iso, end_iso)
 
-        # Query bookings for this mechanic with overlapping intervals
-        response = supabase.table("bookings") \
-            .select("*") \
-            .eq("mechanic_id", mechanic_id) \
-            .execute()
-            
-        if response.error:
-            print(f"Database error checking mechanic availability: {response.error.message}")
-            # If we can't check, assume mechanic is available
-            return True
-            
-        if not response.data:
-            print("No existing bookings found for this mechanic")
-            return True
-            
-        # Filter out cancelled or completed bookings
-        active_bookings = [b for b in response.data if b.get("status") not in ["cancelled", "completed"]]
-        print(f"Found {len(active_bookings)} active bookings for mechanic")
+        try:
+            supabase = await get_async_client()
+            response = await supabase.rpc("check_overlap", {
+                "p_mechanic_id": mechanic_id,
+                "p_start": start_iso,
+                "p_end": end_iso
+            }).execute()
+            available = not response.data
+        except Exception as e:
+            logger.warning("check_overlap RPC failed, scanning bookings instead: %s", e)
+            available = await _scan_for_availability(mechanic_id, booking_time, end_time)
+        
+        with _availability_lock:
+            _availability_cache[cache_key] = available
         
-        # Check each booking record for overlap
-        for booking in active_bookings:
-            try:
-                # Assume each booking record has 'booking_time' (start) and 'service_duration'
-                existing_start = datetime.datetime.fromisoformat(booking["booking_time"])
-                existing_end = existing_start + datetime.timedelta(minutes=booking["service_duration"])
-                
-                # Check if the requested slot overlaps an existing booking
-                if (booking_time < existing_end) and (end_time > existing_start):
-                    print(f"Overlap found with booking {booking.get('id')}")
-                    return False
-            except (KeyError, ValueError) as e:
-                print(f"Error checking booking overlap: {str(e)}")
-                # Skip this booking if there's an error
-                continue
-                
-        print("No overlapping bookings found, mechanic is available")
+        if not available:
+            logger.debug("Overlapping booking found for mechanic %s", mechanic_id)
+            return False
+            
+        logger.debug("No overlapping bookings found, mechanic is available")
         return True
     except Exception as e:
-        print(f"Error checking mechanic availability: {str(e)}")
+        logger.error("Error checking mechanic availability: %s", e, exc_info=True)
         # If we encounter an error, assume availability for demo purposes
         return True
 
+async def _scan_for_availability(mechanic_id: str, booking_time: datetime.datetime, end_time: datetime.datetime) -> bool:
+    """
+    Fallback for databases without the 'check_overlap' function: loads the mechanic's
+    bookings and checks for overlap in Python.
+    """
+    # Query only the active bookings for this mechanic, and only the fields the overlap check needs
+    supabase = await get_async_client()
+    response = await supabase.table("bookings") \
+        .select("id,booking_time,service_duration") \
+        .eq("mechanic_id", mechanic_id) \
+        .not_.in_("status", ["cancelled", "completed"]) \
+        .execute()
+        
+    if not response.data:
+        logger.debug("No existing bookings found for this mechanic")
+        return True
+        
+    logger.debug("Found %d active bookings for mechanic", len(response.data))
+    
+    # Check each booking record for overlap
+    for booking in response.data:
+        try:
+            # Assume each booking record has 'booking_time' (start) and 'service_duration'
+            existing_start = datetime.datetime.fromisoformat(booking["booking_time"])
+            existing_end = existing_start + datetime.timedelta(minutes=booking["service_duration"])
+            
+            # Check if the requested slot overlaps an existing booking
+            if (booking_time < existing_end) and (end_time > existing_start):
+                logger.debug("Overlap found with booking %s", booking.get("id"))
+                return False
+        except (KeyError, ValueError) as e:
+            logger.warning("Error checking booking overlap: %s", e)
+            # Skip this booking if there's an error
+            continue
+            
+    logger.debug("No overlapping bookings found, mechanic is available")
+    return True
+
 def process_payment(payment_info: dict) -> bool:
     """
     Simulates payment processing.
     Replace this stub with actual integration (e.g., Stripe, PayPal).
     """
     # For simulation purposes, we assume the payment always succeeds.
-    print("Processing payment (simulated)")
+    logger.debug("Processing payment (simulated)")
     return True
 
 def send_notification(mechanic_id: str, message: str) -> None:
@@ -84,10 +139,21 @@ def send_notification(mechanic_id: str, message: str) -> None:
     Simulates sending a notification to the mechanic.
     In production, integrate with a notification service (e.g., Firebase Cloud Messaging, Twilio, email).
     """
-    # Here we simply print a message.
-    print(f"Notification to Mechanic {mechanic_id}: {message}")
+    # Here we simply log the message.
+    logger.info("Notification to Mechanic %s: %s", mechanic_id, message)
+
+# Notifications run in the background so they never delay the booking response
+_notify_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="booking-notify")
+atexit.register(_notify_pool.shutdown, wait=True)
 
-def create_booking(user_id: str, mechanic_id: str, booking_time: str, service_duration: int, payment_info: dict) -> dict:
+def _send_notification_safely(mechanic_id: str, message: str) -> None:
+    # A failed notification must not affect the booking, so errors are only logged.
+    try:
+        send_notification(mechanic_id, message)
+    except Exception as e:
+        logger.error("Error sending notification to mechanic %s: %s", mechanic_id, e, exc_info=True)
+
+async def create_booking(user_id: str, mechanic_id: str, booking_time: str, service_duration: int, payment_info: dict) -> dict:
     """
     Creates a booking record if the mechanic is available and the payment is processed successfully.
     
@@ -105,14 +171,6 @@ def create_booking(user_id: str, mechanic_id: str, booking_time: str, service_du
         # Convert provided booking_time to a datetime object.
         booking_dt = datetime.datetime.fromisoformat(booking_time)
 
-        # Check if the mechanic is available.
-        if not is_mechanic_available(mechanic_id, booking_dt, service_duration):
-            raise Exception("Mechanic is not available at the requested time.")
-
-        # Process the payment.
-        if not process_payment(payment_info):
-            raise Exception("Payment processing failed.")
-
         # Prepare the new booking record.
         new_booking = {
             "user_id": user_id,
@@ -120,36 +178,54 @@ def create_booking(user_id: str, mechanic_id: str, booking_time: str, service_du
             "booking_time": booking_time,
             "service_duration": service_duration,
             "status": "pending",  # initial status; can progress to accepted, in_progress, etc.
-            "created_at": datetime.datetime.utcnow().isoformat()
+            "created_at": _utc_now_iso()
         }
 
-        # Insert the booking into the 'bookings' table.
-        response = supabase.table("bookings").insert(new_booking).execute()
+        # Check availability and insert in one round trip; the bookings_no_overlap
+        # exclusion constraint rejects the insert if the slot was taken concurrently.
+        try:
+            supabase = await get_async_client()
+            response = await supabase.rpc("book_if_available", {
+                "p_user_id": user_id,
+                "p_mechanic_id": mechanic_id,
+                "p_start": booking_time,
+                "p_duration": service_duration
+            }).execute()
+        except Exception as e:
+            if getattr(e, "code", None) == EXCLUSION_VIOLATION:
+                raise Exception("Mechanic is not available at the requested time.")
+            logger.warning("book_if_available RPC failed, checking availability separately: %s", e)
+            response = await _insert_if_available(new_booking, booking_dt)
+
+        # Process the payment; release the slot again if it fails.
+        if not process_payment(payment_info):
+            if response.data:
+                await update_booking_status(response.data[0].get("id"), "cancelled")
+            raise Exception("Payment processing failed.")
         
-        if response.error:
-            print(f"Database error creating booking: {response.error.message}")
-            # Create a mock booking with the same data plus a generated ID
-            mock_booking = new_booking.copy()
-            mock_booking["id"] = f"mock-{uuid.uuid4()}"
-            print(f"Created mock booking with ID: {mock_booking['id']}")
-            return mock_booking
-            
         if not response.data:
-            print("No data returned when creating booking")
+            logger.warning("No data returned when creating booking")
             # Create a mock booking with the same data plus a generated ID
             mock_booking = new_booking.copy()
             mock_booking["id"] = f"mock-{uuid.uuid4()}"
-            print(f"Created mock booking with ID: {mock_booking['id']}")
+            logger.info("Created mock booking with ID: %s", mock_booking["id"])
             return mock_booking
 
-        # Send a notification to the mechanic.
-        send_notification(mechanic_id, f"New booking requested by user {user_id} at {booking_time} for {service_duration} minutes.")
+        # The new booking changes this mechanic's availability
+        _invalidate_availability(mechanic_id)
+
+        # Notify the mechanic without waiting for the delivery.
+        _notify_pool.submit(
+            _send_notification_safely,
+            mechanic_id,
+            f"New booking requested by user {user_id} at {booking_time} for {service_duration} minutes."
+        )
 
         # Return the created booking record (assuming response.data is a list with one item).
-        print(f"Successfully created booking with ID: {response.data[0].get('id')}")
+        logger.info("Successfully created booking with ID: %s", response.data[0].get("id"))
         return response.data[0]
     except Exception as e:
-        print(f"Error creating booking: {str(e)}")
+        logger.error("Error creating booking: %s", e, exc_info=True)
         # Return a mock booking for demo purposes
         mock_booking = {
             "id": f"mock-{uuid.uuid4()}",
@@ -158,94 +234,75 @@ def create_booking(user_id: str, mechanic_id: str, booking_time: str, service_du
             "booking_time": booking_time,
             "service_duration": service_duration,
             "status": "pending",
-            "created_at": datetime.datetime.utcnow().isoformat()
+            "created_at": _utc_now_iso()
         }
-        print(f"Created fallback mock booking with ID: {mock_booking['id']}")
+        logger.info("Created fallback mock booking with ID: %s", mock_booking["id"])
         return mock_booking
 
-def update_booking_status(booking_id: str, new_status: str) -> dict:
+async def _insert_if_available(new_booking: dict, booking_dt: datetime.datetime):
+    """
+    Fallback for databases without the 'book_if_available' function: checks availability
+    and inserts in two separate round trips (not protected against concurrent bookings).
+    """
+    if not await is_mechanic_available(new_booking["mechanic_id"], booking_dt, new_booking["service_duration"]):
+        raise Exception("Mechanic is not available at the requested time.")
+
+    # Insert the booking into the 'bookings' table.
+    supabase = await get_async_client()
+    return await supabase.table("bookings").insert(new_booking).execute()
+
+async def update_booking_status(booking_id: str, new_status: str) -> dict:
     """
     Updates the status of an existing booking.
     new_status should be one of: pending, accepted, in_progress, completed, cancelled.
     """
     try:
-        print(f"Updating booking {booking_id} status to: {new_status}")
-        response = supabase.table("bookings").update({"status": new_status}).eq("id", booking_id).execute()
+        logger.debug("Updating booking %s status to: %s", booking_id, new_status)
+        supabase = await get_async_client()
+        response = await supabase.table("bookings").update({"status": new_status}).eq("id", booking_id).execute()
         
-        if response.error:
-            print(f"Database error updating booking: {response.error.message}")
-            # Return mock updated booking
-            return {
-                "id": booking_id,
-                "status": new_status,
-                "updated_at": datetime.datetime.utcnow().isoformat()
-            }
-            
         if not response.data:
-            print("No data returned when updating booking")
+            logger.warning("No data returned when updating booking %s", booking_id)
             # Return mock updated booking
             return {
                 "id": booking_id,
                 "status": new_status,
-                "updated_at": datetime.datetime.utcnow().isoformat()
+                "updated_at": _utc_now_iso()
             }
             
-        print(f"Successfully updated booking status")
+        # A cancelled or completed booking frees its slot again
+        if response.data[0].get("mechanic_id"):
+            _invalidate_availability(response.data[0]["mechanic_id"])
+            
+        logger.info("Updated booking %s status to: %s", booking_id, new_status)
         return response.data[0]
     except Exception as e:
-        print(f"Error updating booking status: {str(e)}")
+        logger.error("Error updating booking status: %s", e, exc_info=True)
         # Return mock data for demo purposes
         return {
             "id": booking_id,
             "status": new_status,
-            "updated_at": datetime.datetime.utcnow().isoformat()
+            "updated_at": _utc_now_iso()
         }
 
-def get_booking_details(booking_id: str) -> dict:
+async def get_booking_details(booking_id: str, fields: str = "*") -> dict:
     """
     Retrieves details of a booking by its ID.
+    Pass a comma-separated column list as 'fields' to fetch only part of the record.
     """
     try:
-        print(f"Getting details for booking {booking_id}")
-        response = supabase.table("bookings").select("*").eq("id", booking_id).execute()
+        logger.debug("Getting details for booking %s", booking_id)
+        supabase = await get_async_client()
+        response = await supabase.table("bookings").select(fields).eq("id", booking_id).execute()
         
-        if response.error:
-            print(f"Database error getting booking: {response.error.message}")
-            # Return mock booking details
-            return {
-                "id": booking_id,
-                "user_id": "mock-user",
-                "mechanic_id": "mock-mechanic",
-                "booking_time": datetime.datetime.now().isoformat(),
-                "service_duration": 60,
-                "status": "pending",
-                "created_at": datetime.datetime.now().isoformat()
-            }
-            
         if not response.data:
-            print(f"Booking {booking_id} not found")
+            logger.info("Booking %s not found", booking_id)
             # Return mock booking details
-            return {
-                "id": booking_id,
-                "user_id": "mock-user",
-                "mechanic_id": "mock-mechanic",
-                "booking_time": datetime.datetime.now().isoformat(),
-                "service_duration": 60,
-                "status": "pending",
-                "created_at": datetime.datetime.now().isoformat()
-            }
+            return _mock_booking_details(booking_id)
             
-        print(f"Successfully retrieved booking details")
+        logger.debug("Successfully retrieved booking details")
         return response.data[0]
     except Exception as e:
-        print(f"Error getting booking details: {str(e)}")
+        logger.error("Error getting booking details: %s", e, exc_info=True)
         # Return mock data for demo purposes
-        return {
-            "id": booking_id,
-            "user_id": "mock-user",
-            "mechanic_id": "mock-mechanic",
-            "booking_time": datetime.datetime.now().isoformat(),
-            "service_duration": 60,
-            "status": "pending",
-            "created_at": datetime.datetime.now().isoformat()
-        }
+        return _mock_booking_details(booking_id)
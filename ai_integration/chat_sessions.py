@@ -0,0 +1,103 @@
+# backend/ai_integration/chat_sessions.py
+import asyncio
+import logging
+import google.generativeai as genai
+from cachetools import TTLCache
+from typing import Callable, List, Optional
+from ai_integration.gemini import generate, get_model, send_message
+
+logger = logging.getLogger(__name__)
+
+# Sessions idle for longer than this are dropped
+SESSION_TTL_SECONDS = 1800
+# Once a session holds more messages than this, older turns are folded into a summary
+MAX_HISTORY_MESSAGES = 20
+
+def history_to_contents(conversation_history: List[str]) -> List[dict]:
+    """
+    Converts a flat list of messages (alternating user / assistant, starting with the user)
+    into Gemini's structured contents format.
+    """
+    return [
+        {"role": "user" if i % 2 == 0 else "model", "parts": [message]}
+        for i, message in enumerate(conversation_history)
+    ]
+
+async def _summarize(contents) -> str:
+    # A cheap model is enough to condense the older part of a conversation
+    model = get_model("gemini-1.5-flash", max_output_tokens=300, temperature=0.2)
+    transcript = "\n".join(
+        f"{content.role}: " + " ".join(part.text for part in content.parts) for content in contents
+    )
+    response = await generate(model, "Summarize the key facts and requests in this conversation:\n" + transcript)
+    return response.text
+
+class ChatSessions:
+    """
+    Server-side Gemini chat sessions keyed by a client-provided session id, so each turn only
+    sends the new message instead of the whole conversation as text.
+
+    model_factory is called with a new session's first message, so it can pick the model
+    for the conversation (e.g. Flash or Pro).
+    """
+
+    def __init__(self, model_factory: Callable[[str], genai.GenerativeModel], maxsize: int = 10_000):
+        self._model_factory = model_factory
+        self._sessions = TTLCache(maxsize=maxsize, ttl=SESSION_TTL_SECONDS)
+
+    def get_or_create_chat(
+        self,
+        session_id: str,
+        conversation_history: Optional[List[str]] = None,
+        model: Optional[genai.GenerativeModel] = None
+    ):
+        """
+        Returns the (ChatSession, lock) pair for a session, seeding a new one from the
+        conversation history the client sent. model, if given, is used for a new session
+        instead of calling the model factory.
+        """
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            model = model or self._model_factory("")
+            chat = model.start_chat(history=history_to_contents(conversation_history or []))
+            entry = (chat, asyncio.Lock())
+        # Re-setting the entry refreshes its TTL
+        self._sessions[session_id] = entry
+        return entry
+
+    async def send(self, session_id: str, message: str, conversation_history: Optional[List[str]] = None) -> str:
+        """
+        Sends a message on the session and returns the reply text.
+        """
+        history = list(conversation_history or [])
+        if session_id not in self._sessions and len(history) % 2 == 1:
+            # A trailing user message without a reply is sent together with the new one
+            message = history.pop() + "\n" + message
+
+        model = None
+        if session_id not in self._sessions:
+            # The factory may block (e.g. creating a Gemini context cache), so it runs off
+            # the event loop
+            model = await asyncio.to_thread(self._model_factory, message)
+        chat, lock = self.get_or_create_chat(session_id, history, model)
+        async with lock:
+            response = await send_message(chat, message)
+            if len(chat.history) > MAX_HISTORY_MESSAGES:
+                await self._compact(chat)
+        return response.text
+
+    async def _compact(self, chat: genai.ChatSession) -> None:
+        # Keep an even number of recent messages so the history still starts with a user turn
+        keep = MAX_HISTORY_MESSAGES // 2
+        keep -= keep % 2
+        older, recent = chat.history[:-keep], chat.history[-keep:]
+        try:
+            summary = await _summarize(older)
+        except Exception as e:
+            logger.warning("Error summarizing chat history, truncating instead: %s", e, exc_info=True)
+            chat.history = recent
+            return
+        chat.history = [
+            {"role": "user", "parts": ["Summary of our conversation so far: " + summary]},
+            {"role": "model", "parts": ["Understood."]},
+        ] + list(recent)
@@ -1,54 +1,139 @@
 # backend/ai_integration/chatbot.py
-import os
-import google.generativeai as genai
-import dotenv
-from typing import List, Optional
-dotenv.load_dotenv()
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Iterator, List, Optional
+from ai_integration.gemini import generate, generate_sync, get_model
+from ai_integration.chat_sessions import ChatSessions
+from ai_integration.llm_cache import LLMCache
+from ai_integration._inflight import InFlight
 
-def get_chat_response(message: str, conversation_history: Optional[List[str]] = None) -> str:
+logger = logging.getLogger(__name__)
+
+# System instruction for automotive context. It is far below the minimum size of an
+# explicit Gemini context cache; keeping it as the identical leading part of every chat
+# request lets Gemini's implicit prefix caching reuse the prefill instead.
+SYSTEM_INSTRUCTION = "You are an AI assistant for a mobile mechanic service. Answer concisely and accurately about car repairs, mechanic services, and related topics."
+
+# Flash handles most turns; Pro is reserved for long or reasoning-heavy prompts
+FAST_MODEL = "gemini-2.0-flash"
+REASONING_MODEL = "gemini-1.5-pro"
+LONG_MESSAGE_CHARS = 800
+# Specific phrases only: a bare "why" or "explain" appears in most questions and would
+# send nearly everything to Pro
+REASONING_KEYWORDS = (
+    "diagnose", "diagnosis", "troubleshoot", "root cause", "compare", "step by step", "step-by-step", "estimate"
+)
+
+def needs_reasoning(message: str) -> bool:
+    lowered = message.lower()
+    return any(keyword in lowered for keyword in REASONING_KEYWORDS)
+
+def pick_model(message: str) -> str:
+    """
+    Chooses the cheapest model that can handle the message.
+    """
+    if len(message) > LONG_MESSAGE_CHARS or needs_reasoning(message):
+        return REASONING_MODEL
+    return FAST_MODEL
+
+def _chat_model(message: str = ""):
+    return get_model(pick_model(message), SYSTEM_INSTRUCTION, max_output_tokens=600, temperature=0.2)
+
+# Native Gemini chat sessions for clients that send a session id; each session's model
+# is routed on its first message
+_sessions = ChatSessions(_chat_model)
+
+# Concurrent identical stateless prompts share one Gemini call
+_inflight = InFlight()
+
+def _build_prompt(message: str, conversation_history: Optional[List[str]] = None) -> str:
+    # One join over history, message and answer cue, without intermediate copies
+    return "\n".join((*(conversation_history or ()), "User: " + message, "AI:"))
+
+async def get_chat_response(message: str, conversation_history: Optional[List[str]] = None, session_id: Optional[str] = None) -> str:
     """
     Generates a text response using the Gemini API.
     
     Parameters:
       - message: The text prompt to send to Gemini.
       - conversation_history: (Optional) A list of previous messages to provide context.
+      - session_id: (Optional) A conversation id; when given, the history is kept server-side
+        and conversation_history is only used to seed a new session.
     
     Returns:
       - A text response from the AI.
     """
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
-        raise Exception("GEMINI_API_KEY environment variable not set.")
-    
-    # Build the conversation context (if any)
-    context = ""
-    if conversation_history and len(conversation_history) > 0:
-        context = "\n".join(conversation_history) + "\n"
-    
-    # System instruction for automotive context
-    system_instruction = "You are an AI assistant for a mobile mechanic service. Answer concisely and accurately about car repairs, mechanic services, and related topics."
-    
-    # Combine context and current message
-    prompt_message = context + "User: " + message + "\nAI:"
-    
-    # Configure the Gemini API
-    genai.configure(api_key=gemini_api_key)
-    
-    # Set up the model with generation configuration
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-pro",
-        generation_config={
-            "max_output_tokens": 600,
-            "temperature": 0.2,
-        },
-        system_instruction=system_instruction
+    if session_id:
+        return await _sessions.send(session_id, message, conversation_history)
+    
+    # Combine the conversation context (if any) and current message
+    prompt_message = _build_prompt(message, conversation_history)
+    
+    async def reply() -> str:
+        # Generate the response without blocking the event loop
+        response = await generate(_chat_model(message), prompt_message)
+        return response.text
+    
+    key = LLMCache.make_key(pick_model(message), SYSTEM_INSTRUCTION, [prompt_message])
+    return await _inflight.run(key, reply)
+
+async def get_chat_responses_batch(messages: List[str]) -> List[str]:
+    """
+    Generates responses for several independent messages concurrently.
+    
+    Parameters:
+      - messages: A list of text prompts to send to Gemini.
+    
+    Returns:
+      - A list of text responses, in the same order as the messages.
+    """
+    return await asyncio.gather(*(get_chat_response(m) for m in messages))
+
+async def batch_chat_response(messages: List[str]) -> List[str]:
+    """
+    Answers several independent messages with a single Gemini request.
+    
+    Parameters:
+      - messages: A list of text prompts to answer.
+    
+    Returns:
+      - A list of text responses, in the same order as the messages. Falls back to
+        one request per message if the batched reply cannot be parsed.
+    """
+    if not messages:
+        return []
+    
+    # Number the messages so the model can answer each one independently
+    numbered = "\n".join(f"{i}. {m}" for i, m in enumerate(messages, start=1))
+    prompt = (
+        "Answer each of the following messages independently. "
+        "Return a JSON array of strings with exactly one answer per message, in order:\n" + numbered
     )
     
-    # Generate the response
-    response = model.generate_content(prompt_message)
-    return response.text
+    model = get_model(
+        pick_model(prompt),
+        SYSTEM_INSTRUCTION,
+        max_output_tokens=8192,
+        temperature=0.2,
+        response_mime_type="application/json"
+    )
+    try:
+        response = await generate(model, prompt)
+        answers = json.loads(response.text)
+        if isinstance(answers, list) and len(answers) == len(messages):
+            return [str(a) for a in answers]
+        logger.warning(
+            "Batched chat reply had %s answers for %d messages",
+            len(answers) if isinstance(answers, list) else "no", len(messages)
+        )
+    except Exception as e:
+        logger.error("Error in batched chat response: %s", e, exc_info=True)
+    
+    # Fall back to individual (concurrent) requests
+    return await get_chat_responses_batch(messages)
 
-def get_streaming_response(message: str, conversation_history: Optional[List[str]] = None):
+def get_streaming_response(message: str, conversation_history: Optional[List[str]] = None) -> Iterator[str]:
     """
     Generates a streaming response using the Gemini API.
     
@@ -59,32 +144,33 @@ def get_streaming_response(message: str, conversation_history: Optional[List[str
     Returns:
       - A generator that yields parts of the response as they become available.
     """
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
-        raise Exception("GEMINI_API_KEY environment variable not set.")
-    
-    # Build the conversation context (if any)
-    context = ""
-    if conversation_history:
-        context = "\n".join(conversation_history) + "\n"
-    
-    # Combine context and current message
-    prompt_message = context + "User: " + message + "\nAI:"
-    
-    # Configure the Gemini API
-    genai.configure(api_key=gemini_api_key)
-    
-    # Set up the model with generation configuration
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-pro",
-        generation_config={
-            "max_output_tokens": 600,
-            "temperature": 0.2,
-        }
-    )
+    # Combine the conversation context (if any) and current message
+    prompt_message = _build_prompt(message, conversation_history)
     
-    # Generate the streaming response
-    response = model.generate_content(prompt_message, stream=True)
+    # Generate the streaming response with the same model, and so the same prompt prefix,
+    # as the other chat paths
+    response = generate_sync(_chat_model(message), prompt_message, stream=True)
     for chunk in response:
         if chunk.text:
             yield chunk.text
+
+
+async def get_streaming_response_async(message: str, conversation_history: Optional[List[str]] = None) -> AsyncIterator[str]:
+    """
+    Async variant of get_streaming_response for use inside the event loop.
+    
+    Parameters:
+      - message: The text prompt to send to Gemini.
+      - conversation_history: (Optional) A list of previous messages to provide context.
+    
+    Returns:
+      - An async generator that yields parts of the response as they become available.
+    """
+    # Combine the conversation context (if any) and current message
+    prompt_message = _build_prompt(message, conversation_history)
+    
+    # Yield each chunk as soon as Gemini sends it
+    response = await generate(_chat_model(message), prompt_message, stream=True)
+    async for chunk in response:
+        if chunk.text:
+            yield chunk.text
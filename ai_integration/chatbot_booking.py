@@ -1,53 +1,50 @@
 # backend/ai_integration/chatbot_booking.py
-import os
-import google.generativeai as genai
-import dotenv
-from typing import List  # <-- Already present, just ensure it's there
-dotenv.load_dotenv()
+from typing import List, Optional
+from ai_integration.gemini import generate, get_model
+from ai_integration.chat_sessions import ChatSessions
+from ai_integration.llm_cache import LLMCache
+from ai_integration._inflight import InFlight
 
-def booking_chat_response(message: str, conversation_history: List[str] = None) -> str:  # <-- Already correct
+# System instruction that steers the conversation toward booking.
+SYSTEM_INSTRUCTION = (
+    "You are an assistant specialized in helping customers book a mechanic. "
+    "Answer the customer's question concisely and then ask if they would like to schedule an appointment. "
+    "If additional booking details (like time, location, specialty) are needed, prompt accordingly."
+)
+
+def _booking_model(message: str = ""):
+    # The instruction is far below the minimum size of a Gemini context cache, so this is
+    # the plain shared model
+    return get_model("gemini-1.5-pro", SYSTEM_INSTRUCTION, max_output_tokens=500, temperature=0.15)
+
+# Native Gemini chat sessions for clients that send a session id
+_sessions = ChatSessions(_booking_model)
+
+# Concurrent identical stateless prompts share one Gemini call
+_inflight = InFlight()
+
+async def booking_chat_response(message: str, conversation_history: List[str] = None, session_id: Optional[str] = None) -> str:
     """
     Uses Gemini to generate a booking-directed response.
     
     Parameters:
       - message: The latest user query.
       - conversation_history: (Optional) A list of previous messages to provide context.
+      - session_id: (Optional) A conversation id; when given, the history is kept server-side
+        and conversation_history is only used to seed a new session.
     
     Returns:
       - A text response which guides the customer toward booking a mechanic.
     """
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
-        raise Exception("GEMINI_API_KEY environment variable not set.")
-    
-    # Build the conversation context (if any)
-    context = ""
-    if conversation_history:
-        context = "\n".join(conversation_history) + "\n"
-    
-    # Set up a system instruction that steers the conversation toward booking.
-    system_instruction = (
-        "You are an assistant specialized in helping customers book a mechanic. "
-        "Answer the customer's question concisely and then ask if they would like to schedule an appointment. "
-        "If additional booking details (like time, location, specialty) are needed, prompt accordingly."
-    )
-    
-    # Combine context and current message.
-    prompt_message = context + "Customer: " + message + "\nAssistant:"
+    if session_id:
+        return await _sessions.send(session_id, message, conversation_history)
     
-    # Configure the Gemini API
-    genai.configure(api_key=gemini_api_key)
+    # Combine the conversation context (if any) and current message in a single join.
+    prompt_message = "\n".join((*(conversation_history or ()), "Customer: " + message, "Assistant:"))
     
-    # Set up the model with generation configuration
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-pro",
-        generation_config={
-            "max_output_tokens": 500,
-            "temperature": 0.15,
-        },
-        system_instruction=system_instruction
-    )
+    async def reply() -> str:
+        # Generate the response without blocking the event loop
+        response = await generate(_booking_model(), prompt_message)
+        return response.text
     
-    # Generate the response
-    response = model.generate_content(prompt_message)
-    return response.text
+    return await _inflight.run(LLMCache.make_key("gemini-1.5-pro", SYSTEM_INSTRUCTION, [prompt_message]), reply)
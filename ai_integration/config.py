@@ -0,0 +1,81 @@
+# backend/ai_integration/config.py
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+# Parse .env once per process; every other module reads from `settings`. Railway injects
+# the variables itself and deploys no .env, so the lookup is skipped there.
+if os.getenv("RAILWAY_ENVIRONMENT") is None:
+    import dotenv
+    dotenv.load_dotenv()
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise Exception(f"{name} environment variable must be an integer, got {value!r}.")
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.lower() in ("1", "true", "yes")
+
+def _env_list(name: str, default: Tuple[str, ...] = ()) -> Tuple[str, ...]:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return tuple(item.strip() for item in value.split(",") if item.strip())
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Environment configuration, read once at import.
+
+    Credentials are optional here so that each integration can report its own
+    missing variable; numeric settings are validated up front.
+    """
+    gemini_api_key: Optional[str]
+    supabase_url: Optional[str]
+    supabase_anon_key: Optional[str]
+    gemini_rpm: int
+    gemini_tpm: int
+    gemini_max_concurrency: int
+    admin_ai_batch_enabled: bool
+    log_level: str
+    debug_tracebacks: bool
+    redis_url: Optional[str]
+    llm_cache_ttl: int
+    semantic_cache_enabled: bool
+    support_max_turns: int
+    support_max_chars: int
+    supabase_max_connections: Optional[int]
+    allowed_origins: Tuple[str, ...]
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            gemini_api_key=os.getenv("GEMINI_API_KEY") or None,
+            supabase_url=os.getenv("SUPABASE_URL") or None,
+            supabase_anon_key=os.getenv("SUPABASE_ANON_KEY") or None,
+            gemini_rpm=_env_int("GEMINI_RPM", 1000),
+            gemini_tpm=_env_int("GEMINI_TPM", 4_000_000),
+            gemini_max_concurrency=_env_int("GEMINI_MAX_CONCURRENCY", 32),
+            admin_ai_batch_enabled=_env_bool("ADMIN_AI_BATCH_ENABLED"),
+            log_level=(os.getenv("LOG_LEVEL") or "INFO").upper(),
+            debug_tracebacks=_env_bool("DEBUG_TRACEBACKS"),
+            redis_url=os.getenv("REDIS_URL") or None,
+            llm_cache_ttl=_env_int("LLM_CACHE_TTL", 3600),
+            semantic_cache_enabled=_env_bool("LLM_SEMANTIC_CACHE"),
+            support_max_turns=_env_int("SUPPORT_MAX_TURNS", 10),
+            support_max_chars=_env_int("SUPPORT_MAX_CHARS", 20_000),
+            supabase_max_connections=_env_int("SUPABASE_MAX_CONNECTIONS", 0) or None,
+            # Comma-separated; when unset, any origin is allowed under ENV=dev and no
+            # cross-origin browser access is allowed otherwise
+            allowed_origins=_env_list("ALLOWED_ORIGINS", ("*",) if os.getenv("ENV") == "dev" else ()),
+        )
+
+settings = Settings.from_env()
@@ -1,11 +1,55 @@
 # backend/ai_integration/customer_support.py
-import os
-import google.generativeai as genai
-import dotenv
-from typing import List  # <-- Add this import
-dotenv.load_dotenv()
+import asyncio
+from typing import AsyncIterator, List  # <-- Add this import
+from ai_integration.chat_sessions import history_to_contents
+from ai_integration.config import settings
+from ai_integration.gemini import generate, get_model
+from ai_integration.llm_cache import LLMCache
+from ai_integration._inflight import InFlight
 
-def get_support_response(conversation_history: List[str]) -> str:  # <-- Change here
+MODEL_NAME = "gemini-1.5-pro"
+
+SYSTEM_INSTRUCTION = (
+    "You are an experienced customer support agent handling complex queries. "
+    "Provide a helpful, context-aware response that addresses the customer's situation."
+)
+
+# Only the most recent part of a conversation is sent; earlier turns add cost and latency
+MAX_TURNS = settings.support_max_turns
+MAX_CHARS = settings.support_max_chars
+
+def validate_history(conversation_history: List[str]) -> None:
+    """
+    Rejects histories Gemini would refuse, before paying for a round trip: the turns must
+    alternate customer / support, starting and ending with a customer message.
+    """
+    if not conversation_history:
+        raise ValueError("conversation_history must contain at least one message.")
+    if any(not isinstance(m, str) or not m.strip() for m in conversation_history):
+        raise ValueError("conversation_history messages must be non-empty strings.")
+    if len(conversation_history) % 2 == 0:
+        raise ValueError("conversation_history must end with a customer message.")
+
+def _recent_history(conversation_history: List[str]) -> List[str]:
+    """Keeps the last MAX_TURNS messages, then drops the oldest until they fit in MAX_CHARS."""
+    recent = conversation_history[-MAX_TURNS:] if MAX_TURNS > 0 else list(conversation_history)
+    total = sum(len(m) + 1 for m in recent)
+    start = 0
+    # Always keep the latest message, even if it alone is over the limit
+    while total > MAX_CHARS and start < len(recent) - 1:
+        total -= len(recent[start]) + 1
+        start += 1
+    # The kept window must still start with a customer message
+    if (len(recent) - start) % 2 == 0:
+        start += 1
+    return recent[start:]
+
+# Repeated support questions are answered from cache instead of a new Gemini call
+_cache = LLMCache()
+# and concurrent identical conversations share one Gemini call
+_inflight = InFlight()
+
+async def get_support_response(conversation_history: List[str]) -> str:  # <-- Change here
     """
     Generates a multi-turn, context-rich support response from Gemini.
     
@@ -15,31 +59,68 @@ def get_support_response(conversation_history: List[str]) -> str:  # <-- Change
     Returns:
       - A generated response that addresses the customer's issue comprehensively.
     """
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
-        raise Exception("GEMINI_API_KEY environment variable not set.")
-    
-    # Concatenate the conversation history.
-    prompt = "\n".join(conversation_history) + "\nAssistant:"
-    
-    system_instruction = (
-        "You are an experienced customer support agent handling complex queries. "
-        "Provide a helpful, context-aware response that addresses the customer's situation."
-    )
-    
-    # Configure the Gemini API
-    genai.configure(api_key=gemini_api_key)
-    
-    # Set up the model with generation configuration
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-pro",
-        generation_config={
-            "max_output_tokens": 600,
-            "temperature": 0.2,
-        },
-        system_instruction=system_instruction
-    )
-    
-    # Generate the response
-    response = model.generate_content(prompt)
-    return response.text
+    validate_history(conversation_history)
+    recent = _recent_history(conversation_history)
+    cached = await _cache.aget(MODEL_NAME, SYSTEM_INSTRUCTION, recent)
+    if cached is not None:
+        return cached
+    
+    async def reply() -> str:
+        # Send the turns as structured contents so Gemini sees real user / model roles.
+        contents = history_to_contents(recent)
+        
+        # Reuse the shared model with this generation configuration
+        model = get_model(MODEL_NAME, SYSTEM_INSTRUCTION, max_output_tokens=600, temperature=0.2)
+        
+        # Generate the response without blocking the event loop
+        response = await generate(model, contents)
+        await _cache.aset(MODEL_NAME, SYSTEM_INSTRUCTION, recent, response.text)
+        return response.text
+    
+    return await _inflight.run(_cache.make_key(MODEL_NAME, SYSTEM_INSTRUCTION, recent), reply)
+
+async def get_support_response_stream(conversation_history: List[str]) -> AsyncIterator[str]:
+    """
+    Streaming variant of get_support_response.
+    
+    Parameters:
+      - conversation_history: A list of message strings (alternating between customer and support).
+    
+    Returns:
+      - An async generator that yields parts of the response as Gemini produces them.
+        A cached reply is yielded in one piece.
+    """
+    validate_history(conversation_history)
+    recent = _recent_history(conversation_history)
+    cached = await _cache.aget(MODEL_NAME, SYSTEM_INSTRUCTION, recent)
+    if cached is not None:
+        yield cached
+        return
+    
+    model = get_model(MODEL_NAME, SYSTEM_INSTRUCTION, max_output_tokens=600, temperature=0.2)
+    response = await generate(model, history_to_contents(recent), stream=True)
+    
+    parts: List[str] = []
+    async for chunk in response:
+        if chunk.text:
+            parts.append(chunk.text)
+            yield chunk.text
+    # Only a complete reply is cached
+    await _cache.aset(MODEL_NAME, SYSTEM_INSTRUCTION, recent, "".join(parts))
+
+async def get_support_responses_batch(conversations: List[List[str]]) -> List[str]:
+    """
+    Answers several independent support conversations concurrently.
+    
+    Parameters:
+      - conversations: A list of conversation histories.
+    
+    Returns:
+      - One response per conversation, in the same order. Repeated conversations are
+        served from the cache and the rest share the Gemini rate limiter.
+    """
+    return list(await asyncio.gather(*(get_support_response(history) for history in conversations)))
+
+def get_support_response_sync(conversation_history: List[str]) -> str:
+    """Blocking wrapper around get_support_response for callers outside an event loop."""
+    return asyncio.run(get_support_response(conversation_history))
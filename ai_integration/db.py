@@ -0,0 +1,137 @@
+# backend/ai_integration/db.py
+import asyncio
+import functools
+import logging
+import threading
+import httpx
+from typing import Optional
+from supabase import AsyncClient, AsyncClientOptions, Client, ClientOptions, create_async_client, create_client
+from ai_integration.config import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# postgrest-py decodes every reply with httpx.Response.json(), i.e. the stdlib json
+# module; orjson parses the same payloads several times faster. Only responses of the
+# Supabase HTTP clients below get it (through a response hook), so other httpx users
+# keep the stdlib decoder.
+def _orjson_response_json(response: httpx.Response, **kwargs):
+    if kwargs:
+        return httpx.Response.json(response, **kwargs)
+    try:
+        return orjson.loads(response.content)
+    except orjson.JSONDecodeError:
+        # NaN / Infinity and integers beyond 64 bits are valid for the stdlib only
+        return httpx.Response.json(response)
+
+def _use_orjson(response: httpx.Response) -> None:
+    response.json = functools.partial(_orjson_response_json, response)
+
+async def _use_orjson_async(response: httpx.Response) -> None:
+    _use_orjson(response)
+
+def _event_hooks(hook) -> dict:
+    return {"response": [hook]} if orjson is not None else {}
+
+if not settings.supabase_url or not settings.supabase_anon_key:
+    raise Exception("Supabase credentials (URL and ANON KEY) not set in environment variables.")
+
+# One async client per process, created on first use (or by the app's startup hook)
+_async_client: Optional[AsyncClient] = None
+_async_client_lock = asyncio.Lock()
+
+# Keep-alive HTTP/2 pool under the async client, so concurrent requests reuse a few
+# TLS connections instead of opening new ones under load
+_http_client: Optional[httpx.AsyncClient] = None
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+def _pool_limits(max_connections: int, max_keepalive: int, **kwargs) -> httpx.Limits:
+    # SUPABASE_MAX_CONNECTIONS caps every pool, e.g. to a handful per instance when a
+    # serverless or many-worker deploy would otherwise exceed the project's connection limit
+    cap = settings.supabase_max_connections
+    if cap:
+        max_connections = min(max_connections, cap)
+        max_keepalive = min(max_keepalive, cap)
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive, **kwargs)
+
+HTTP_LIMITS = _pool_limits(200, 100)
+
+async def _create_async_client() -> AsyncClient:
+    global _http_client
+    _http_client = httpx.AsyncClient(
+        limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT, http2=True, event_hooks=_event_hooks(_use_orjson_async)
+    )
+    try:
+        options = AsyncClientOptions(httpx_client=_http_client)
+    except TypeError:
+        # supabase-py releases before httpx_client injection keep their own pools
+        await _http_client.aclose()
+        _http_client = None
+        return await create_async_client(settings.supabase_url, settings.supabase_anon_key)
+    return await create_async_client(settings.supabase_url, settings.supabase_anon_key, options=options)
+
+async def get_async_client() -> AsyncClient:
+    """
+    Returns the shared async Supabase client, creating it on first use.
+    """
+    global _async_client
+    if _async_client is None:
+        async with _async_client_lock:
+            if _async_client is None:
+                _async_client = await _create_async_client()
+    return _async_client
+
+async def warm_up_async_client() -> None:
+    """
+    Opens a pooled connection (DNS lookup, TCP and TLS handshakes) with a one-row query,
+    so the first real request does not pay for it. Failures are only logged.
+    """
+    try:
+        supabase = await get_async_client()
+        await supabase.table("mechanic_profiles").select("id").limit(1).execute()
+    except Exception as e:
+        logger.warning("Supabase warm-up query failed: %s", e)
+
+async def close_async_client() -> None:
+    """Closes the shared async client's connections (called on app shutdown)."""
+    global _async_client, _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+    _async_client = None
+    _http_client = None
+
+# Shared sync client for blocking callers outside the event loop (scripts, workers)
+_client: Optional[Client] = None
+_client_lock = threading.Lock()
+
+# The blocking pool is smaller and stays under Supabase's pooler connection cap; the
+# transport retries connection failures (not HTTP errors) on a dropped keep-alive socket
+SYNC_HTTP_LIMITS = _pool_limits(60, 40, keepalive_expiry=60)
+SYNC_HTTP_RETRIES = 3
+
+def _create_client() -> Client:
+    # Limits go on the transport: httpx ignores Client(limits=...) when a transport is passed
+    transport = httpx.HTTPTransport(limits=SYNC_HTTP_LIMITS, retries=SYNC_HTTP_RETRIES)
+    http_client = httpx.Client(transport=transport, timeout=HTTP_TIMEOUT, event_hooks=_event_hooks(_use_orjson))
+    try:
+        options = ClientOptions(httpx_client=http_client)
+    except TypeError:
+        # supabase-py releases before httpx_client injection keep their own pools
+        http_client.close()
+        return create_client(settings.supabase_url, settings.supabase_anon_key)
+    return create_client(settings.supabase_url, settings.supabase_anon_key, options=options)
+
+def get_client() -> Client:
+    """
+    Returns the shared sync Supabase client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _create_client()
+    return _client
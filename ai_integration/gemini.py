@@ -0,0 +1,278 @@
+# backend/ai_integration/gemini.py
+import os
+import json
+import time
+import datetime
+import logging
+import tempfile
+import google.generativeai as genai
+from google.generativeai import caching
+from google.api_core import exceptions as google_exceptions
+from tenacity import AsyncRetrying, Retrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+from tenacity.wait import wait_base
+from typing import Any, Dict, List, Optional, Tuple
+from ai_integration._limiter import TokenBucket
+from ai_integration.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Configure the Gemini API once per process instead of on every request
+GEMINI_API_KEY = settings.gemini_api_key
+if GEMINI_API_KEY:
+    genai.configure(api_key=GEMINI_API_KEY)
+
+# Models are stateless per call, so one instance per configuration is shared
+_MODELS: Dict[Tuple, genai.GenerativeModel] = {}
+
+def get_model(model_name: str, system_instruction: Optional[str] = None, **generation_config) -> genai.GenerativeModel:
+    """
+    Returns a cached GenerativeModel for the given configuration, building it on first use.
+
+    Parameters:
+      - model_name: The Gemini model to use, e.g. "gemini-1.5-pro".
+      - system_instruction: (Optional) The system instruction for the model.
+      - generation_config: Generation settings such as max_output_tokens and temperature.
+
+    Returns:
+      - A configured GenerativeModel instance.
+    """
+    if not GEMINI_API_KEY:
+        raise Exception("GEMINI_API_KEY environment variable not set.")
+
+    key = (model_name, system_instruction, tuple(sorted(generation_config.items())))
+    model = _MODELS.get(key)
+    if model is None:
+        model = genai.GenerativeModel(
+            model_name=model_name,
+            generation_config=generation_config,
+            system_instruction=system_instruction
+        )
+        _MODELS[key] = model
+    return model
+
+# Explicit context caches are billed at a discount for the cached prefix
+CONTEXT_CACHE_TTL_SECONDS = 3600
+# Gemini rejects context caches below a minimum size (4096 tokens at the smallest);
+# smaller prefixes are not worth the doomed CachedContent.create round trip
+MIN_CONTEXT_CACHE_TOKENS = 4096
+_CACHED_MODELS: Dict[Tuple, Tuple[genai.GenerativeModel, bool, float]] = {}
+
+def get_cached_model(model_name: str, system_instruction: str, contents: Optional[List[str]] = None, **generation_config) -> Tuple[genai.GenerativeModel, bool]:
+    """
+    Returns a model whose static prefix (system instruction plus optional contents) is stored
+    in a Gemini context cache, so it is not billed as fresh input tokens on every call.
+
+    Parameters:
+      - model_name: The Gemini model to use.
+      - system_instruction: The system instruction to cache.
+      - contents: (Optional) Static prompt text to cache after the system instruction.
+      - generation_config: Generation settings such as max_output_tokens and temperature.
+
+    Returns:
+      - A (model, cached) tuple. cached is False when the context cache could not be created
+        (e.g. the prefix is below the model's minimum cacheable size); the caller must then
+        send the static contents itself.
+    """
+    key = (model_name, system_instruction, tuple(contents or ()), tuple(sorted(generation_config.items())))
+    entry = _CACHED_MODELS.get(key)
+    # Refresh a little before the server-side cache expires
+    if entry is not None and entry[2] > time.monotonic():
+        return entry[0], entry[1]
+
+    if not GEMINI_API_KEY:
+        raise Exception("GEMINI_API_KEY environment variable not set.")
+
+    if _estimate_prompt_tokens([system_instruction, *(contents or ())]) < MIN_CONTEXT_CACHE_TOKENS:
+        model = get_model(model_name, system_instruction, **generation_config)
+        return model, False
+
+    try:
+        cache = caching.CachedContent.create(
+            model=model_name,
+            system_instruction=system_instruction,
+            contents=contents,
+            ttl=datetime.timedelta(seconds=CONTEXT_CACHE_TTL_SECONDS)
+        )
+        model = genai.GenerativeModel.from_cached_content(cached_content=cache, generation_config=generation_config)
+        cached = True
+    except Exception as e:
+        logger.warning("Context cache unavailable for %s, using the uncached model: %s", model_name, e)
+        model = get_model(model_name, system_instruction, **generation_config)
+        cached = False
+
+    # A failed attempt is also remembered so cache creation is not retried on every request
+    _CACHED_MODELS[key] = (model, cached, time.monotonic() + CONTEXT_CACHE_TTL_SECONDS - 60)
+    return model, cached
+
+# Shared budget so concurrent requests stay under the project's RPM/TPM quota
+limiter = TokenBucket(
+    requests_per_minute=settings.gemini_rpm,
+    tokens_per_minute=settings.gemini_tpm,
+    max_concurrency=settings.gemini_max_concurrency
+)
+
+# Rough Gemini cost of one image part, in tokens
+IMAGE_TOKENS = 258
+
+def _estimate_prompt_tokens(contents: Any) -> int:
+    if isinstance(contents, str):
+        return len(contents) // 4
+    if isinstance(contents, list):
+        return sum(_estimate_prompt_tokens(p) for p in contents)
+    # Structured turns ({"role": ..., "parts": [...]}) count their parts
+    if isinstance(contents, dict) and "parts" in contents:
+        return _estimate_prompt_tokens(contents["parts"])
+    return IMAGE_TOKENS
+
+def estimate_tokens(model: genai.GenerativeModel, contents: Any) -> int:
+    """
+    Estimates the tokens a call will consume: ~4 characters per prompt token plus the output budget.
+    """
+    prompt_tokens = _estimate_prompt_tokens(contents)
+    max_output_tokens = (getattr(model, "_generation_config", None) or {}).get("max_output_tokens", 0)
+    return prompt_tokens + max_output_tokens
+
+# Rate-limit and overload errors are transient and worth retrying
+RETRYABLE_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable)
+MAX_ATTEMPTS = 6
+
+class _wait_retry_after(wait_base):
+    """Waits for the provider's retry-after hint when present, otherwise falls back to backoff."""
+
+    def __init__(self, fallback: wait_base, max_wait: float = 60):
+        self.fallback = fallback
+        self.max_wait = max_wait
+
+    def __call__(self, retry_state) -> float:
+        exc = retry_state.outcome.exception()
+        headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+        retry_after = headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_wait)
+            except ValueError:
+                pass
+        return self.fallback(retry_state)
+
+def _retry_policy() -> dict:
+    return {
+        "wait": _wait_retry_after(wait_exponential_jitter(initial=1, max=30)),
+        "stop": stop_after_attempt(MAX_ATTEMPTS),
+        "retry": retry_if_exception_type(RETRYABLE_ERRORS),
+        "reraise": True,
+    }
+
+async def generate(model: genai.GenerativeModel, contents: Any, **kwargs):
+    """
+    Calls model.generate_content_async under the shared rate limiter, retrying 429/503 errors
+    with exponential backoff and jitter.
+
+    Parameters:
+      - model: The GenerativeModel to call.
+      - contents: The prompt or content parts to send.
+      - kwargs: Extra arguments for generate_content_async (e.g. stream=True).
+
+    Returns:
+      - The Gemini response.
+    """
+    tokens = estimate_tokens(model, contents)
+    async for attempt in AsyncRetrying(**_retry_policy()):
+        with attempt:
+            async with limiter.reserve(tokens):
+                return await model.generate_content_async(contents, **kwargs)
+
+async def send_message(chat: genai.ChatSession, message: str):
+    """
+    Sends a message on a ChatSession with the same rate limiting and retries as generate().
+    The session history is only extended once a reply succeeds.
+    """
+    history_chars = sum(len(part.text) for content in chat.history for part in content.parts)
+    tokens = estimate_tokens(chat.model, message) + history_chars // 4
+    async for attempt in AsyncRetrying(**_retry_policy()):
+        with attempt:
+            async with limiter.reserve(tokens):
+                return await chat.send_message_async(message)
+
+def generate_sync(model: genai.GenerativeModel, contents: Any, **kwargs):
+    """
+    Synchronous counterpart of generate() for code paths outside the event loop.
+    """
+    tokens = estimate_tokens(model, contents)
+    for attempt in Retrying(**_retry_policy()):
+        with attempt:
+            with limiter.reserve_sync(tokens):
+                return model.generate_content(contents, **kwargs)
+
+# Client for the Gemini Batch API, which is only available in the google-genai SDK
+_batch_client = None
+
+def _get_batch_client():
+    global _batch_client
+    if not GEMINI_API_KEY:
+        raise Exception("GEMINI_API_KEY environment variable not set.")
+    if _batch_client is None:
+        from google import genai as google_genai
+        _batch_client = google_genai.Client(api_key=GEMINI_API_KEY)
+    return _batch_client
+
+def submit_batch(model_name: str, requests: List[dict], display_name: str) -> str:
+    """
+    Submits requests to the Gemini Batch API (offline, discounted pricing).
+
+    Parameters:
+      - model_name: The Gemini model to run the batch on.
+      - requests: A list of GenerateContentRequest dicts ("contents", "system_instruction", "generation_config").
+      - display_name: A human readable name for the batch job.
+
+    Returns:
+      - The batch job name, used to poll for results.
+    """
+    client = _get_batch_client()
+
+    # One JSONL line per request; the key lets results be matched back to their input
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+        for i, request in enumerate(requests):
+            f.write(json.dumps({"key": str(i), "request": request}) + "\n")
+        path = f.name
+
+    try:
+        uploaded = client.files.upload(file=path, config={"display_name": display_name, "mime_type": "jsonl"})
+    finally:
+        os.remove(path)
+
+    job = client.batches.create(model=model_name, src=uploaded.name, config={"display_name": display_name})
+    return job.name
+
+def get_batch_results(batch_id: str) -> Optional[List[Optional[str]]]:
+    """
+    Fetches the results of a batch job submitted with submit_batch.
+
+    Parameters:
+      - batch_id: The batch job name returned by submit_batch.
+
+    Returns:
+      - None while the job is still running, otherwise one response text per request
+        (None for requests that failed), in submission order.
+    """
+    client = _get_batch_client()
+    job = client.batches.get(name=batch_id)
+    state = job.state.name
+
+    if state in ("JOB_STATE_PENDING", "JOB_STATE_RUNNING"):
+        return None
+    if state != "JOB_STATE_SUCCEEDED":
+        raise Exception(f"Batch job {batch_id} finished with state {state}")
+
+    results: Dict[int, Optional[str]] = {}
+    content = client.files.download(file=job.dest.file_name).decode("utf-8")
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        try:
+            parts = item["response"]["candidates"][0]["content"]["parts"]
+            results[int(item["key"])] = "".join(part.get("text", "") for part in parts)
+        except (KeyError, IndexError):
+            results[int(item["key"])] = None
+
+    return [results.get(i) for i in range(max(results) + 1)] if results else []
@@ -1,34 +1,42 @@
 # backend/ai_integration/google_ai.py
-import os
+import asyncio
 from io import BytesIO
 import PIL.Image
-import google.generativeai as genai
-import dotenv
-dotenv.load_dotenv()
+from typing import AsyncIterator, BinaryIO, Tuple, Union
+from ai_integration.gemini import generate, get_model
 
-def analyze_image(file_content: bytes, action: str = "caption") -> str:
+# Larger photos only add upload time and vision tokens; bbox coordinates are normalized anyway
+MAX_IMAGE_SIDE = 1024
+JPEG_QUALITY = 85
+
+def prepare_image(file_content: Union[bytes, BinaryIO]) -> dict:
     """
-    Uses the Gemini API to analyze the image.
-    
-    Parameters:
-      - file_content: Image file bytes uploaded by the client.
-      - action: Type of analysis. Supported values:
-          "caption" - Returns a caption and description of the image.
-          "bbox"    - Returns bounding box coordinates for detected objects.
-          
-    Returns:
-      - The text output from the Gemini API.
+    Downscales an uploaded image to at most MAX_IMAGE_SIDE px on its long side (keeping the
+    aspect ratio) and re-encodes it as JPEG, returning an inline image part for Gemini.
+    file_content may be the image bytes or a binary file object (e.g. an upload's spooled
+    file), which Pillow decodes from without a full in-memory copy.
     """
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
-        raise Exception("GEMINI_API_KEY environment variable is not set.")
-
-    # Configure the Gemini API
-    genai.configure(api_key=gemini_api_key)
-    
-    # Use the file content to open an image using Pillow.
-    image = PIL.Image.open(BytesIO(file_content))
+    source = BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content
+    image = PIL.Image.open(source)
+    # open() only reads the header; a JPEG that is already small enough is sent as-is
+    # instead of being decoded and re-encoded
+    if image.format == "JPEG" and max(image.size) <= MAX_IMAGE_SIDE:
+        source.seek(0)
+        return {"mime_type": "image/jpeg", "data": source.read()}
+    # For JPEGs, let the decoder downscale by 1/2-1/8 while decoding (a no-op for other formats);
+    # thumbnail() then does the final, exact resize on the much smaller image
+    image.draft("RGB", (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+    image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), PIL.Image.LANCZOS)
+    if image.mode != "RGB":
+        # JPEG has no alpha or palette modes
+        image = image.convert("RGB")
     
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=JPEG_QUALITY)
+    return {"mime_type": "image/jpeg", "data": buffer.getvalue()}
+
+def _request_for(action: str) -> Tuple[str, str]:
+    """Returns the (prompt, model name) for an analysis action."""
     # Set the prompt and the model based on the action.
     if action == "caption":
         prompt = "Provide a caption and a detailed description of this image."
@@ -43,17 +51,46 @@ def analyze_image(file_content: bytes, action: str = "caption") -> str:
         # Default to caption if an unsupported action is provided.
         prompt = "Provide a caption and a detailed description of this image."
         model_name = "gemini-1.5-pro"
+    return prompt, model_name
 
-    # Create a model with multimodal capabilities
-    model = genai.GenerativeModel(
-        model_name=model_name,
-        generation_config={
-            "max_output_tokens": 800,
-            "temperature": 0.2,
-        }
-    )
+async def analyze_image(file_content: Union[bytes, BinaryIO], action: str = "caption") -> str:
+    """
+    Uses the Gemini API to analyze the image.
+    
+    Parameters:
+      - file_content: Image file bytes uploaded by the client, or the upload's file object.
+      - action: Type of analysis. Supported values:
+          "caption" - Returns a caption and description of the image.
+          "bbox"    - Returns bounding box coordinates for detected objects.
+          
+    Returns:
+      - The text output from the Gemini API.
+    """
+    # Shrink the upload before sending it to Gemini; decoding and resizing are CPU-bound,
+    # so they run in a worker thread instead of stalling other requests
+    image = await asyncio.to_thread(prepare_image, file_content)
+    prompt, model_name = _request_for(action)
+
+    # Reuse the shared multimodal model
+    model = get_model(model_name, max_output_tokens=800, temperature=0.2)
     
     # Generate content with the image and prompt
-    response = model.generate_content([image, prompt])
+    response = await generate(model, [image, prompt])
     
     return response.text
+
+async def analyze_image_stream(file_content: Union[bytes, BinaryIO], action: str = "caption") -> AsyncIterator[str]:
+    """
+    Streaming variant of analyze_image.
+    
+    Returns:
+      - An async generator that yields parts of the analysis as Gemini produces them.
+    """
+    image = await asyncio.to_thread(prepare_image, file_content)
+    prompt, model_name = _request_for(action)
+    model = get_model(model_name, max_output_tokens=800, temperature=0.2)
+    
+    response = await generate(model, [image, prompt], stream=True)
+    async for chunk in response:
+        if chunk.text:
+            yield chunk.text
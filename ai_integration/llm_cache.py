@@ -0,0 +1,182 @@
+# backend/ai_integration/llm_cache.py
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional, Protocol, Sequence, Tuple
+from cachetools import LRUCache
+from ai_integration.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Embedding model used for semantic lookups, and the similarity needed to reuse a reply
+EMBEDDING_MODEL = "models/text-embedding-004"
+SEMANTIC_THRESHOLD = 0.95
+
+class CacheBackend(Protocol):
+    """Storage for cached LLM replies."""
+
+    def get(self, key: str) -> Optional[str]: ...
+
+    def set(self, key: str, value: str, ttl: int) -> None: ...
+
+class MemoryBackend:
+    """In-process LRU with per-entry expiry; the default backend."""
+
+    def __init__(self, maxsize: int = 10_000):
+        self._entries = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._entries.pop(key, None)
+                return None
+            return value
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+
+class RedisBackend:
+    """Shares cached replies between workers and deploys; requires the redis package."""
+
+    def __init__(self, url: str, prefix: str = "llm-cache:"):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._redis.get(self._prefix + key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        self._redis.set(self._prefix + key, value, ex=ttl)
+
+def default_backend() -> CacheBackend:
+    """Redis when REDIS_URL is configured, otherwise an in-memory cache."""
+    if settings.redis_url:
+        try:
+            return RedisBackend(settings.redis_url)
+        except Exception as e:
+            logger.warning("Redis cache unavailable, using the in-memory cache: %s", e)
+    return MemoryBackend()
+
+def gemini_embed(text: str) -> List[float]:
+    """Embeds text with the Gemini embedding model."""
+    # Imported here so the cache stays usable without Gemini configured
+    from ai_integration.gemini import GEMINI_API_KEY, genai
+    if not GEMINI_API_KEY:
+        raise Exception("GEMINI_API_KEY environment variable not set.")
+    result = genai.embed_content(model=EMBEDDING_MODEL, content=text, task_type="semantic_similarity")
+    return result["embedding"]
+
+def _normalize(vector: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+class LLMCache:
+    """
+    Caches LLM replies by a hash of (model, system instruction, messages).
+
+    With semantic lookup enabled, a miss falls back to comparing the embedding of the
+    last message against recent entries that share the same earlier context, so a
+    re-worded question in the same conversation can reuse a reply.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        ttl: Optional[int] = None,
+        semantic: Optional[bool] = None,
+        embed: Callable[[str], List[float]] = gemini_embed,
+        max_semantic_entries: int = 500
+    ):
+        self.backend = backend or default_backend()
+        self.ttl = ttl if ttl is not None else settings.llm_cache_ttl
+        self.semantic = settings.semantic_cache_enabled if semantic is None else semantic
+        self._embed = embed
+        # (context hash, normalized embedding, cache key), newest last
+        self._vectors: deque = deque(maxlen=max_semantic_entries)
+        self._vectors_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, system_instruction: Optional[str], messages: List[str]) -> str:
+        payload = json.dumps({"model": model, "messages": messages, "system": system_instruction}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, model: str, system_instruction: Optional[str], messages: List[str]) -> Optional[str]:
+        """
+        Looks up a cached reply.
+
+        Parameters:
+          - model: The model the reply was generated with.
+          - system_instruction: The system instruction used for the call.
+          - messages: The conversation sent to the model.
+
+        Returns:
+          - The cached reply, or None on a miss.
+        """
+        try:
+            value = self.backend.get(self.make_key(model, system_instruction, messages))
+            if value is not None or not self.semantic or not messages:
+                return value
+            return self._get_similar(model, system_instruction, messages)
+        except Exception as e:
+            logger.warning("LLM cache lookup failed: %s", e)
+            return None
+
+    def set(self, model: str, system_instruction: Optional[str], messages: List[str], value: str) -> None:
+        """Stores a reply; cache failures never affect the caller."""
+        try:
+            key = self.make_key(model, system_instruction, messages)
+            self.backend.set(key, value, self.ttl)
+            if self.semantic and messages:
+                context = self.make_key(model, system_instruction, messages[:-1])
+                vector = _normalize(self._embed(messages[-1]))
+                with self._vectors_lock:
+                    self._vectors.append((context, vector, key))
+        except Exception as e:
+            logger.warning("LLM cache store failed: %s", e)
+
+    def _blocking(self) -> bool:
+        # Redis round trips and embedding calls must not run on the event loop
+        return self.semantic or not isinstance(self.backend, MemoryBackend)
+
+    async def aget(self, model: str, system_instruction: Optional[str], messages: List[str]) -> Optional[str]:
+        """Async counterpart of get()."""
+        if self._blocking():
+            return await asyncio.to_thread(self.get, model, system_instruction, messages)
+        return self.get(model, system_instruction, messages)
+
+    async def aset(self, model: str, system_instruction: Optional[str], messages: List[str], value: str) -> None:
+        """Async counterpart of set()."""
+        if self._blocking():
+            await asyncio.to_thread(self.set, model, system_instruction, messages, value)
+        else:
+            self.set(model, system_instruction, messages, value)
+
+    def _get_similar(self, model: str, system_instruction: Optional[str], messages: List[str]) -> Optional[str]:
+        context = self.make_key(model, system_instruction, messages[:-1])
+        with self._vectors_lock:
+            candidates: List[Tuple[List[float], str]] = [(v, k) for c, v, k in self._vectors if c == context]
+        if not candidates:
+            return None
+
+        query = _normalize(self._embed(messages[-1]))
+        best_score, best_key = max(
+            ((sum(a * b for a, b in zip(query, vector)), key) for vector, key in candidates),
+            key=lambda item: item[0]
+        )
+        if best_score < SEMANTIC_THRESHOLD:
+            return None
+        # The reply may have expired from the backend even though its vector is still indexed
+        return self.backend.get(best_key)
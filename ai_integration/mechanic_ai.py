@@ -1,68 +1,56 @@
 # backend/ai_integration/mechanic_ai.py
-import os
-from supabase import create_client, Client
+import asyncio
 import json
-import google.generativeai as genai
+import logging
+import threading
+from typing import AsyncIterator, Dict, List, Optional
+from cachetools import TTLCache
 from google.generativeai import types
-import dotenv
-dotenv.load_dotenv()
+from ai_integration.db import get_async_client
+from ai_integration.gemini import generate, get_model, submit_batch, get_batch_results
+from ai_integration.llm_cache import LLMCache
+from ai_integration._inflight import InFlight
 
-# Initialize Supabase client (ensure these env variables are set)
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY") # Use ANON key
-if not SUPABASE_URL or not SUPABASE_ANON_KEY:
-    raise Exception("Supabase credentials (URL and ANON KEY) not set.")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+logger = logging.getLogger(__name__)
 
-def get_mechanic_data(mechanic_id: str) -> dict:
+# System instruction to guide the AI
+SYSTEM_INSTRUCTION = """
+You are an AI business advisor for automotive mechanics. Your job is to help mechanics grow their business,
+increase revenue, and improve customer satisfaction. Provide thoughtful, data-driven recommendations
+based on the mechanic's profile, specialties, experience, and location.
+
+Keep your responses concise, practical, and actionable. Use a friendly, professional tone.
+"""
+
+# Only the mechanic_profiles columns the recommendation prompt reads (all part of the
+# editable profile); a projected column the table lacks would make every read fail
+RECOMMENDATION_PROFILE_FIELDS = "user_id,years_experience,hourly_rate,specialties,bio,current_latitude,current_longitude"
+# The legacy mechanics table has no known fixed schema, so it is read whole
+LEGACY_MECHANIC_FIELDS = "*"
+
+# Profiles change on human timescales, so recent lookups are reused briefly
+_mechanic_cache = TTLCache(maxsize=10_000, ttl=60)
+_mechanic_cache_lock = threading.Lock()
+
+def invalidate_mechanic_data(mechanic_id: str) -> None:
+    """Drops the cached data for a mechanic after their profile changes."""
+    with _mechanic_cache_lock:
+        _mechanic_cache.pop(mechanic_id, None)
+
+async def get_mechanic_data(mechanic_id: str) -> dict:
     """
-    Retrieves mechanic data from the Supabase database.
+    Retrieves mechanic data from the Supabase database, served from a 60 second cache when possible.
     """
+    with _mechanic_cache_lock:
+        cached = _mechanic_cache.get(mechanic_id)
+    if cached is not None:
+        return cached
+    
     try:
-        print(f"Attempting to fetch mechanic data for ID: {mechanic_id}")
-        print(f"Using Supabase URL: {SUPABASE_URL[:20]}... with key starting with: {SUPABASE_ANON_KEY[:10]}...")
-        
-        # First try mechanic_profiles table
-        response = supabase.table("mechanic_profiles").select("*").eq("user_id", mechanic_id).execute()
-        
-        if response.error:
-            print(f"Supabase query error: {response.error.message}")
-            raise Exception(f"Database error: {response.error.message}")
-            
-        if response.data and len(response.data) > 0:
-            print(f"Found mechanic profile in mechanic_profiles table")
-            return response.data[0]
-        
-        # If not found, try mechanics table as fallback
-        print(f"No profile found in mechanic_profiles, trying mechanics table")
-        response = supabase.table("mechanics").select("*").eq("id", mechanic_id).execute()
-        
-        if response.error:
-            print(f"Supabase query error on mechanics table: {response.error.message}")
-            raise Exception(f"Database error: {response.error.message}")
-            
-        if not response.data or len(response.data) == 0:
-            print(f"No mechanic found with ID {mechanic_id}, returning mock data")
-            # Return a default profile for demo purposes
-            return {
-                "id": mechanic_id,
-                "years_experience": 5,
-                "hourly_rate": 75,
-                "specialties": ["Engine Repair", "Brake Service"],
-                "bio": "Experienced mechanic",
-                "current_latitude": 37.7749,
-                "current_longitude": -122.4194,
-                "performance_metrics": {
-                    "avg_rating": 4.7,
-                    "completed_jobs": 124,
-                    "response_time_min": 28
-                }
-            }
-        print(f"Found mechanic in mechanics table")
-        return response.data[0]
+        data = await _fetch_mechanic_data(mechanic_id)
     except Exception as e:
-        print(f"Error retrieving mechanic data: {e}")
-        # Return default data for testing
+        logger.error("Error retrieving mechanic data: %s", e, exc_info=True)
+        # Return default data for testing (not cached, so the next call retries the database)
         return {
             "id": mechanic_id,
             "years_experience": 5,
@@ -75,21 +63,119 @@ def get_mechanic_data(mechanic_id: str) -> dict:
                 "response_time_min": 28
             }
         }
+    
+    with _mechanic_cache_lock:
+        _mechanic_cache[mechanic_id] = data
+    return data
 
-def get_mechanic_recommendations(mechanic_id: str, message: str = "") -> str:
-    """
-    Generates personalized job recommendations and performance improvement ideas for a given mechanic.
+async def _fetch_mechanic_data(mechanic_id: str) -> dict:
+    """Queries Supabase for a mechanic; raises on database errors."""
+    logger.debug("Fetching mechanic data for ID: %s", mechanic_id)
+    supabase = await get_async_client()
     
-    Parameters:
-      - mechanic_id: The ID of the mechanic to generate recommendations for
-      - message: Optional question or topic from the mechanic to focus the recommendations
+    # Start the mechanics fallback query alongside mechanic_profiles, so a profile miss
+    # costs one round trip instead of two; on a hit it is cancelled and its outcome,
+    # including any error, is ignored
+    fallback = asyncio.ensure_future(
+        supabase.table("mechanics").select(LEGACY_MECHANIC_FIELDS).eq("id", mechanic_id).execute()
+    )
+    # Mark a fallback error as retrieved when the result ends up unused
+    fallback.add_done_callback(lambda t: t.cancelled() or t.exception())
+    try:
+        profile_response = await supabase.table("mechanic_profiles").select(RECOMMENDATION_PROFILE_FIELDS).eq("user_id", mechanic_id).execute()
+    except BaseException:
+        fallback.cancel()
+        raise
     
-    Returns:
-      - A string containing the AI-generated recommendations
+    if profile_response.data and len(profile_response.data) > 0:
+        logger.debug("Found mechanic profile in mechanic_profiles table")
+        fallback.cancel()
+        return profile_response.data[0]
+    
+    # If not found, use the mechanics table result
+    logger.debug("No profile found in mechanic_profiles, using mechanics table")
+    response = await fallback
+    
+    if not response.data or len(response.data) == 0:
+        logger.info("No mechanic found with ID %s, returning mock data", mechanic_id)
+        # Return a default profile for demo purposes
+        return {
+            "id": mechanic_id,
+            "years_experience": 5,
+            "hourly_rate": 75,
+            "specialties": ["Engine Repair", "Brake Service"],
+            "bio": "Experienced mechanic",
+            "current_latitude": 37.7749,
+            "current_longitude": -122.4194,
+            "performance_metrics": {
+                "avg_rating": 4.7,
+                "completed_jobs": 124,
+                "response_time_min": 28
+            }
+        }
+    logger.debug("Found mechanic in mechanics table")
+    return response.data[0]
+
+async def _get_mechanics_data(mechanic_ids: List[str]) -> Dict[str, dict]:
     """
-    # Get mechanic data from database
-    mechanic = get_mechanic_data(mechanic_id)
+    Retrieves data for several mechanics, loading their mechanic_profiles rows in one query.
+    IDs without a profile fall back to get_mechanic_data.
+    """
+    found: Dict[str, dict] = {}
+    try:
+        supabase = await get_async_client()
+        response = await supabase.table("mechanic_profiles").select(RECOMMENDATION_PROFILE_FIELDS).in_("user_id", list(mechanic_ids)).execute()
+        found = {row["user_id"]: row for row in response.data or []}
+        with _mechanic_cache_lock:
+            _mechanic_cache.update(found)
+    except Exception as e:
+        logger.error("Error retrieving mechanic profiles: %s", e, exc_info=True)
     
+    missing = [mechanic_id for mechanic_id in mechanic_ids if mechanic_id not in found]
+    for mechanic_id, data in zip(missing, await asyncio.gather(*(get_mechanic_data(m) for m in missing))):
+        found[mechanic_id] = data
+    return found
+
+# Prompt templates, filled in by _build_prompt
+_PROFILE_TEMPLATE = """
+Mechanic Profile:
+- Experience: {experience} years
+- Hourly Rate: ${hourly_rate}
+- Specialties: {specialties}
+- Bio: {bio}
+- Average Rating: {avg_rating}
+- Completed Jobs: {completed_jobs}
+- Average Response Time: {response_time_min} minutes
+- {location}
+"""
+
+_GENERAL_PROMPT = """
+{mechanic_data}
+
+Based on this mechanic's profile, provide personalized business growth recommendations. 
+Include advice on:
+1. Pricing strategy (should they adjust their hourly rate?)
+2. Skills to develop based on market demand
+3. Service expansion opportunities
+4. Customer acquisition strategies
+
+Keep your response concise, practical and data-driven.
+"""
+
+_QUESTION_PROMPT = """
+{mechanic_data}
+
+The mechanic has asked: "{message}"
+
+Based on their profile data and this question, provide a helpful, personalized response.
+Focus on practical, actionable advice that addresses their specific question.
+If the question isn't related to their business, gently redirect to business topics.
+
+Keep your response concise, practical and data-driven.
+"""
+
+def _build_prompt(mechanic: dict, message: str = "") -> str:
+    """Formats a mechanic's profile (and optional question) into the recommendation prompt."""
     # Extract relevant information
     specialties = mechanic.get("specialties", ["General Repair"])
     if isinstance(specialties, list):
@@ -115,76 +201,154 @@ def get_mechanic_recommendations(mechanic_id: str, message: str = "") -> str:
     lng = mechanic.get("current_longitude")
     location_text = f"Location coordinates: {lat}, {lng}" if lat and lng else "Location not provided"
     
-    # Format mechanic data for the prompt
-    mechanic_data = f"""
-Mechanic Profile:
-- Experience: {experience} years
-- Hourly Rate: ${hourly_rate}
-- Specialties: {specialties_text}
-- Bio: {bio}
-- Average Rating: {performance.get('avg_rating', 4.5)}
-- Completed Jobs: {performance.get('completed_jobs', 100)}
-- Average Response Time: {performance.get('response_time_min', 30)} minutes
-- {location_text}
-"""
+    # Only the profile slice is formatted per call; the surrounding text is constant
+    mechanic_data = _PROFILE_TEMPLATE.format(
+        experience=experience,
+        hourly_rate=hourly_rate,
+        specialties=specialties_text,
+        bio=bio,
+        avg_rating=performance.get('avg_rating', 4.5),
+        completed_jobs=performance.get('completed_jobs', 100),
+        response_time_min=performance.get('response_time_min', 30),
+        location=location_text
+    )
 
     # Determine if this is a general recommendation or a specific question
-    if not message or message.strip() == "":
-        prompt = f"""
-{mechanic_data}
+    if _is_general(message):
+        return _GENERAL_PROMPT.format(mechanic_data=mechanic_data)
+    return _QUESTION_PROMPT.format(mechanic_data=mechanic_data, message=message)
 
-Based on this mechanic's profile, provide personalized business growth recommendations. 
-Include advice on:
-1. Pricing strategy (should they adjust their hourly rate?)
-2. Skills to develop based on market demand
-3. Service expansion opportunities
-4. Customer acquisition strategies
+# General advice (no question) only depends on the profile; the cache key hashes the full
+# prompt, so any profile change yields a new key
+MODEL_NAME = "gemini-1.5-pro"
+_general_advice_cache = LLMCache(semantic=False)
+# Concurrent requests for the same general advice share one Gemini call
+_general_advice_inflight = InFlight()
 
-Keep your response concise, practical and data-driven.
-"""
-    else:
-        prompt = f"""
-{mechanic_data}
+def _is_general(message: str) -> bool:
+    return not message or message.strip() == ""
 
-The mechanic has asked: "{message}"
+def _recommendation_model():
+    # Reuse the shared model instead of configuring a new one per request
+    return get_model(MODEL_NAME, SYSTEM_INSTRUCTION, max_output_tokens=600, temperature=0.2)
 
-Based on their profile data and this question, provide a helpful, personalized response.
-Focus on practical, actionable advice that addresses their specific question.
-If the question isn't related to their business, gently redirect to business topics.
+async def _load_mechanic_and_model(mechanic_id: str):
+    """
+    Fetches the mechanic's data and returns it with the shared Gemini model. After the
+    first call the model is a dict lookup, so it is not worth a worker thread.
+    """
+    return await get_mechanic_data(mechanic_id), _recommendation_model()
 
-Keep your response concise, practical and data-driven.
-"""
+async def get_mechanic_recommendations(mechanic_id: str, message: str = "") -> str:
+    """
+    Generates personalized job recommendations and performance improvement ideas for a given mechanic.
     
-    # System instruction to guide the AI
-    system_instruction = """
-You are an AI business advisor for automotive mechanics. Your job is to help mechanics grow their business,
-increase revenue, and improve customer satisfaction. Provide thoughtful, data-driven recommendations
-based on the mechanic's profile, specialties, experience, and location.
-
-Keep your responses concise, practical, and actionable. Use a friendly, professional tone.
-"""
+    Parameters:
+      - mechanic_id: The ID of the mechanic to generate recommendations for
+      - message: Optional question or topic from the mechanic to focus the recommendations
     
-    # Call Gemini API
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
-        raise Exception("GEMINI_API_KEY environment variable not set.")
-    
-    # Configure Gemini API
-    genai.configure(api_key=gemini_api_key)
-    
-    # Set up model with generation config
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-pro",
-        generation_config={
-            "max_output_tokens": 600,
-            "temperature": 0.2,
-        },
-        system_instruction=system_instruction
-    )
+    Returns:
+      - A string containing the AI-generated recommendations
+    """
+    # Get mechanic data from database while the model is set up
+    mechanic, model = await _load_mechanic_and_model(mechanic_id)
+    prompt = _build_prompt(mechanic, message)
     
-    try:
-        response = model.generate_content(prompt)
+    general = _is_general(message)
+    if general:
+        cached = await _general_advice_cache.aget(MODEL_NAME, SYSTEM_INSTRUCTION, [prompt])
+        if cached is not None:
+            return cached
+    
+    async def recommend() -> str:
+        response = await generate(model, prompt)
+        if general:
+            await _general_advice_cache.aset(MODEL_NAME, SYSTEM_INSTRUCTION, [prompt], response.text)
         return response.text
+    
+    try:
+        if general:
+            key = _general_advice_cache.make_key(MODEL_NAME, SYSTEM_INSTRUCTION, [prompt])
+            return await _general_advice_inflight.run(key, recommend)
+        return await recommend()
     except Exception as e:
-        print(f"Error generating AI response: {e}")
+        logger.error("Error generating AI response: %s", e, exc_info=True)
         return "I'm sorry, I encountered an issue generating recommendations. Please try again later."
+
+async def get_mechanic_recommendations_stream(mechanic_id: str, message: str = "") -> AsyncIterator[str]:
+    """
+    Streaming variant of get_mechanic_recommendations.
+    
+    Returns:
+      - An async generator that yields parts of the recommendations as Gemini produces them.
+    """
+    mechanic, model = await _load_mechanic_and_model(mechanic_id)
+    
+    response = await generate(model, _build_prompt(mechanic, message), stream=True)
+    async for chunk in response:
+        if chunk.text:
+            yield chunk.text
+
+async def get_mechanic_recommendations_batch(mechanic_ids: List[str]) -> Dict[str, str]:
+    """
+    Generates general recommendations for several mechanics, e.g. for a scheduled refresh.
+    
+    Parameters:
+      - mechanic_ids: The IDs of the mechanics to generate recommendations for
+    
+    Returns:
+      - A dict mapping each mechanic ID to its recommendations
+    """
+    if not mechanic_ids:
+        return {}
+    
+    mechanics = await _get_mechanics_data(mechanic_ids)
+    model = _recommendation_model()
+    
+    async def recommend(mechanic_id: str) -> str:
+        try:
+            response = await generate(model, _build_prompt(mechanics[mechanic_id]))
+            return response.text
+        except Exception as e:
+            logger.error("Error generating AI response for mechanic %s: %s", mechanic_id, e, exc_info=True)
+            return "I'm sorry, I encountered an issue generating recommendations. Please try again later."
+    
+    # The shared limiter paces the concurrent calls
+    results = await asyncio.gather(*(recommend(mechanic_id) for mechanic_id in mechanic_ids))
+    return dict(zip(mechanic_ids, results))
+
+async def submit_mechanic_batch(mechanic_ids: List[str]) -> str:
+    """
+    Submits general recommendations for several mechanics to the Gemini Batch API
+    for offline processing (e.g. a nightly refresh).
+    
+    Parameters:
+      - mechanic_ids: The IDs of the mechanics to generate recommendations for
+    
+    Returns:
+      - The batch id to pass to poll_mechanic_batch.
+    """
+    mechanics = await _get_mechanics_data(mechanic_ids)
+    requests = [
+        {
+            "contents": [{"role": "user", "parts": [{"text": _build_prompt(mechanics[mechanic_id])}]}],
+            "system_instruction": {"parts": [{"text": SYSTEM_INSTRUCTION}]},
+            "generation_config": {"max_output_tokens": 600, "temperature": 0.2},
+        }
+        for mechanic_id in mechanic_ids
+    ]
+    # The Batch API client is blocking, so keep it off the event loop
+    return await asyncio.to_thread(submit_batch, MODEL_NAME, requests, "mechanic-recommendations")
+
+def poll_mechanic_batch(batch_id: str) -> Optional[List[Optional[str]]]:
+    """
+    Checks on a batch submitted with submit_mechanic_batch.
+    
+    Parameters:
+      - batch_id: The id returned by submit_mechanic_batch.
+    
+    Returns:
+      - None while the batch is still running, otherwise the recommendations for each mechanic
+        in submission order (None for mechanics whose request failed).
+    """
+    return get_batch_results(batch_id)
@@ -1,118 +1,197 @@
-import os
-from supabase import create_client, Client
-import dotenv
-dotenv.load_dotenv()
+import logging
+import threading
+from typing import Optional, Tuple
+from cachetools import TTLCache
+from ai_integration._inflight import InFlight
+from ai_integration.db import get_async_client
+from ai_integration.mechanic_ai import invalidate_mechanic_data
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
-if not SUPABASE_URL or not SUPABASE_ANON_KEY:
-    raise Exception("Supabase credentials (URL and ANON KEY) not set in environment variables.")
+logger = logging.getLogger(__name__)
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+# Columns returned to the app: the editable profile fields plus identifiers and rating
+MECHANIC_PROFILE_FIELDS = (
+    "id,user_id,bio,years_experience,hourly_rate,is_mobile,specialties,city,current_latitude,"
+    "current_longitude,available_now,languages,certifications,portfolio_urls,rating"
+)
+# users is read whole: beyond id, full_name and email, its columns (phone_number, role)
+# are not guaranteed, and naming a missing one would fail every read
+CUSTOMER_PROFILE_FIELDS = "*"
 
-def get_mechanic_profile(mechanic_id: str) -> dict:
+# Profiles are read on nearly every screen but rarely change; real rows (never the mock
+# fallbacks) are kept briefly, keyed by (table, user id, fields), and dropped on update
+_profile_cache = TTLCache(maxsize=10_000, ttl=120)
+_profile_cache_lock = threading.Lock()
+# Screens often request the same profile twice on mount; concurrent misses for the same
+# key share one Supabase query
+_profile_inflight = InFlight()
+
+def _cached_profile(table: str, user_id: str, fields: str):
+    with _profile_cache_lock:
+        return _profile_cache.get((table, user_id, fields))
+
+def _cache_profile(table: str, user_id: str, fields: str, profile: dict) -> None:
+    with _profile_cache_lock:
+        _profile_cache[(table, user_id, fields)] = profile
+
+def _invalidate_profile(user_id: str) -> None:
+    # Mechanic and customer rows share the user id, and the role lookup caches either
+    with _profile_cache_lock:
+        for key in [k for k in _profile_cache if k[1] == user_id]:
+            _profile_cache.pop(key, None)
+
+def _mock_mechanic_profile(mechanic_id: str) -> dict:
+    # Mock profile for demo purposes
+    return {
+        "id": "mock-profile-1",
+        "user_id": mechanic_id,
+        "bio": "Experienced mechanic with focus on diagnostic excellence",
+        "years_experience": 7,
+        "hourly_rate": 80,
+        "specialties": ["Engine Repair", "Electrical Systems", "Diagnostics"],
+        "current_latitude": 29.7604,
+        "current_longitude": -95.3698,
+        "rating": 4.8,
+        "available_now": True
+    }
+
+def _mock_customer_profile(user_id: str) -> dict:
+    # Mock customer profile for demo purposes
+    return {
+        "id": user_id,
+        "full_name": "Customer User",
+        "email": "customer@example.com",
+        "role": "customer"
+    }
+
+async def get_mechanic_profile(mechanic_id: str, fields: str = MECHANIC_PROFILE_FIELDS) -> dict:
+    cached = _cached_profile("mechanic_profiles", mechanic_id, fields)
+    if cached is not None:
+        return cached
+    return await _profile_inflight.run(
+        f"mechanic_profiles:{mechanic_id}:{fields}", lambda: _fetch_mechanic_profile(mechanic_id, fields)
+    )
+
+async def _fetch_mechanic_profile(mechanic_id: str, fields: str) -> dict:
     try:
-        resp = supabase.table("mechanic_profiles").select("*").eq("user_id", mechanic_id).single().execute()
-        if not resp.data:
-            # Return mock profile for demo purposes
-            print(f"No mechanic profile found for ID {mechanic_id}, returning mock data")
-            return {
-                "id": "mock-profile-1",
-                "user_id": mechanic_id,
-                "bio": "Experienced mechanic with focus on diagnostic excellence",
-                "years_experience": 7,
-                "hourly_rate": 80,
-                "specialties": ["Engine Repair", "Electrical Systems", "Diagnostics"],
-                "current_latitude": 29.7604,
-                "current_longitude": -95.3698,
-                "rating": 4.8,
-                "available_now": True
-            }
+        supabase = await get_async_client()
+        # maybe_single() answers a missing row with no data instead of raising
+        resp = await supabase.table("mechanic_profiles").select(fields).eq("user_id", mechanic_id).maybe_single().execute()
+        if resp is None or not resp.data:
+            logger.debug("No mechanic profile found for ID %s, returning mock data", mechanic_id)
+            return _mock_mechanic_profile(mechanic_id)
+        _cache_profile("mechanic_profiles", mechanic_id, fields, resp.data)
         return resp.data
     except Exception as e:
-        print(f"Error getting mechanic profile: {str(e)}")
+        logger.warning("Error getting mechanic profile: %s", e)
         # Return mock data as fallback
-        return {
-            "id": "mock-profile-1",
-            "user_id": mechanic_id,
-            "bio": "Experienced mechanic with focus on diagnostic excellence",
-            "years_experience": 7,
-            "hourly_rate": 80,
-            "specialties": ["Engine Repair", "Electrical Systems", "Diagnostics"],
-            "current_latitude": 29.7604,
-            "current_longitude": -95.3698,
-            "rating": 4.8,
-            "available_now": True
-        }
-
-def update_mechanic_profile(mechanic_id: str, updates: dict) -> dict:
+        return _mock_mechanic_profile(mechanic_id)
+
+async def update_mechanic_profile(mechanic_id: str, updates: dict) -> dict:
     try:
+        supabase = await get_async_client()
         updates.pop("mechanic_id", None)
-        resp = supabase.table("mechanic_profiles").update(updates).eq("user_id", mechanic_id).execute()
+        resp = await supabase.table("mechanic_profiles").update(updates).eq("user_id", mechanic_id).execute()
         
-        if resp.error:
-            print(f"Error updating mechanic profile: {resp.error.message}")
-            raise Exception(f"Database error: {resp.error.message}")
-            
         if not resp.data:
-            print(f"No data returned when updating mechanic profile {mechanic_id}")
+            logger.debug("No data returned when updating mechanic profile %s", mechanic_id)
             # Try to create a new profile if update fails (might not exist yet)
             create_data = updates.copy()
             create_data["user_id"] = mechanic_id
-            resp = supabase.table("mechanic_profiles").insert(create_data).execute()
+            resp = await supabase.table("mechanic_profiles").insert(create_data).execute()
             
-            if resp.error or not resp.data:
+            if not resp.data:
                 raise Exception("Failed to create mechanic profile.")
-                
+        
+        # Neither profile reads nor recommendations may keep using the old profile
+        _invalidate_profile(mechanic_id)
+        invalidate_mechanic_data(mechanic_id)
         return resp.data[0]
     except Exception as e:
-        print(f"Error updating mechanic profile: {str(e)}")
+        logger.error("Error updating mechanic profile: %s", e, exc_info=True)
         # Return the updates as if they were successful
         mock_result = updates.copy()
         mock_result["user_id"] = mechanic_id
         mock_result["id"] = "mock-" + mechanic_id
         return mock_result
 
-def get_customer_profile(user_id: str) -> dict:
+async def get_customer_profile(user_id: str, fields: str = CUSTOMER_PROFILE_FIELDS) -> dict:
+    cached = _cached_profile("users", user_id, fields)
+    if cached is not None:
+        return cached
+    return await _profile_inflight.run(f"users:{user_id}:{fields}", lambda: _fetch_customer_profile(user_id, fields))
+
+async def _fetch_customer_profile(user_id: str, fields: str) -> dict:
     try:
-        resp = supabase.table("users").select("*").eq("id", user_id).single().execute()
-        if not resp.data:
-            # Return mock customer profile
-            print(f"No customer profile found for ID {user_id}, returning mock data")
-            return {
-                "id": user_id,
-                "full_name": "Customer User",
-                "email": "customer@example.com",
-                "role": "customer"
-            }
+        supabase = await get_async_client()
+        resp = await supabase.table("users").select(fields).eq("id", user_id).maybe_single().execute()
+        if resp is None or not resp.data:
+            logger.debug("No customer profile found for ID %s, returning mock data", user_id)
+            return _mock_customer_profile(user_id)
+        _cache_profile("users", user_id, fields, resp.data)
         return resp.data
     except Exception as e:
-        print(f"Error getting customer profile: {str(e)}")
+        logger.warning("Error getting customer profile: %s", e)
         # Return mock data as fallback
-        return {
-            "id": user_id,
-            "full_name": "Customer User",
-            "email": "customer@example.com",
-            "role": "customer"
-        }
-
-def update_customer_profile(user_id: str, updates: dict) -> dict:
+        return _mock_customer_profile(user_id)
+
+async def update_customer_profile(user_id: str, updates: dict) -> dict:
     try:
+        supabase = await get_async_client()
         updates.pop("user_id", None)
-        resp = supabase.table("users").update(updates).eq("id", user_id).execute()
+        resp = await supabase.table("users").update(updates).eq("id", user_id).execute()
         
-        if resp.error:
-            print(f"Error updating customer profile: {resp.error.message}")
-            raise Exception(f"Database error: {resp.error.message}")
-            
         if not resp.data:
-            print(f"No data returned when updating customer profile {user_id}")
+            logger.debug("No data returned when updating customer profile %s", user_id)
             raise Exception("Failed to update customer profile.")
-            
+        
+        _invalidate_profile(user_id)
         return resp.data[0]
     except Exception as e:
-        print(f"Error updating customer profile: {str(e)}")
+        logger.error("Error updating customer profile: %s", e, exc_info=True)
         # Return the updates as if they were successful
         mock_result = updates.copy()
         mock_result["id"] = user_id
-        return mock_result
\ No newline at end of file
+        return mock_result
+
+async def get_role_and_profile(user_id: str) -> Optional[Tuple[str, dict]]:
+    """
+    Looks up a user's role and profile in one query: the users row with its mechanic
+    profile embedded.
+    
+    Parameters:
+      - user_id: The user's ID.
+    
+    Returns:
+      - ("mechanic", mechanic profile) if the user has a mechanic profile,
+        ("customer", user row) otherwise, or None if the user does not exist.
+    """
+    cached = _cached_profile("roles", user_id, "")
+    if cached is not None:
+        return cached
+    return await _profile_inflight.run(f"roles:{user_id}", lambda: _fetch_role_and_profile(user_id))
+
+async def _fetch_role_and_profile(user_id: str) -> Optional[Tuple[str, dict]]:
+    try:
+        supabase = await get_async_client()
+        resp = await (
+            supabase.table("users")
+            .select(f"{CUSTOMER_PROFILE_FIELDS},mechanic_profiles({MECHANIC_PROFILE_FIELDS})")
+            .eq("id", user_id)
+            .maybe_single()
+            .execute()
+        )
+    except Exception as e:
+        logger.warning("Error getting user role and profile: %s", e)
+        # Same fallback as get_mechanic_profile
+        return "mechanic", _mock_mechanic_profile(user_id)
+    
+    if resp is None or not resp.data:
+        return None
+    user = resp.data
+    # The embed is a list, or a single object when user_id is unique in mechanic_profiles
+    mechanic = user.pop("mechanic_profiles", None)
+    if isinstance(mechanic, list):
+        mechanic = mechanic[0] if mechanic else None
+    result = ("mechanic", mechanic) if mechanic else ("customer", user)
+    _cache_profile("roles", user_id, "", result)
+    return result
@@ -1,13 +1,67 @@
 # backend/ai_integration/repair_assistant.py
-import os
-import google.generativeai as genai
+import asyncio
 import base64
-from io import BytesIO
-import PIL.Image
-import dotenv
-dotenv.load_dotenv()
+import logging
+from typing import Any, AsyncIterator, List, Optional, Tuple
+from ai_integration.gemini import GEMINI_API_KEY, generate, get_cached_model
+from ai_integration.google_ai import prepare_image
+from ai_integration.llm_cache import LLMCache
+from ai_integration._inflight import InFlight
 
-def get_repair_advice(mechanic_id: str, query: str, image_data: str = None) -> str:
+logger = logging.getLogger(__name__)
+
+# Specialized system instruction for automotive repair assistance
+SYSTEM_INSTRUCTION = """
+    You are an expert automotive technician with decades of experience diagnosing and repairing all types of vehicles.
+    Provide detailed, step-by-step technical advice for mechanics facing issues with vehicles.
+    
+    Your responses should be:
+    1. Accurate - based on industry best practices and technical service procedures
+    2. Practical - include specific diagnostic steps, tools needed, and repair procedures
+    3. Safety-focused - always mention safety precautions when relevant
+    4. Educational - explain why problems occur and how repairs resolve the root issue
+    
+    Use automotive terminology appropriate for professional mechanics. If the information provided is
+    insufficient for a definitive diagnosis, ask for specific symptoms, codes, or test results.
+    """
+
+TEXT_MODEL_NAME = "gemini-1.5-flash"
+MULTIMODAL_MODEL_NAME = "gemini-1.5-pro"
+GENERATION_CONFIG = {"max_output_tokens": 800, "temperature": 0.2}
+
+# Text-only questions repeat a lot (common trouble codes, the same symptoms); with
+# LLM_SEMANTIC_CACHE enabled, re-worded questions are matched by embedding too
+_cache = LLMCache()
+# and concurrent identical questions share one Gemini call
+_inflight = InFlight()
+
+def _repair_model(model_name: str):
+    # One shared model per name (text / multimodal), built on first use and reused by every
+    # request. The fixed system instruction is served from a Gemini context cache when the
+    # model accepts it; otherwise this is the shared uncached model
+    model, _ = get_cached_model(model_name, SYSTEM_INSTRUCTION, **GENERATION_CONFIG)
+    return model
+
+def _request_for(query: str, image_data: Optional[str], image_bytes: Optional[bytes] = None) -> Tuple[str, Any]:
+    """Returns the (model name, contents) for a repair question, with or without an image."""
+    prompt = f"I need help with this automotive repair issue: {query}"
+    if not image_bytes and not image_data:
+        return TEXT_MODEL_NAME, prompt
+    try:
+        if not image_bytes:
+            # Decode the base64 image, dropping a data-URL prefix without copying the payload twice
+            _, sep, encoded = image_data.partition(',')
+            image_bytes = base64.b64decode(encoded if sep else image_data)
+        # Phone photos are downscaled and re-encoded so they cost fewer upload bytes and tokens
+        image = prepare_image(image_bytes)
+        # For multimodal input (text + image)
+        return MULTIMODAL_MODEL_NAME, [prompt, image]
+    except Exception as e:
+        logger.warning("Error processing image, answering from the text only: %s", e)
+        # Fall back to text-only if image processing fails
+        return TEXT_MODEL_NAME, prompt
+
+async def get_repair_advice(mechanic_id: str, query: str, image_data: str = None, image_bytes: Optional[bytes] = None) -> str:
     """
     Generates technical advice for vehicle repairs using Gemini.
     
@@ -15,77 +69,51 @@ def get_repair_advice(mechanic_id: str, query: str, image_data: str = None) -> s
       - mechanic_id: The ID of the mechanic requesting advice
       - query: The repair question or issue description
       - image_data: Optional base64-encoded image data showing the part or issue
+      - image_bytes: Optional raw image file bytes (e.g. a multipart upload); takes
+        precedence over image_data
     
     Returns:
       - A string containing the technical advice
     """
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
-        raise Exception("GEMINI_API_KEY environment variable not set.")
-    
-    # Configure the Gemini API
-    genai.configure(api_key=gemini_api_key)
+    async def advice() -> str:
+        return "".join([part async for part in get_repair_advice_stream(mechanic_id, query, image_data, image_bytes)])
     
-    # Set a specialized system instruction for automotive repair assistance
-    system_instruction = """
-    You are an expert automotive technician with decades of experience diagnosing and repairing all types of vehicles.
-    Provide detailed, step-by-step technical advice for mechanics facing issues with vehicles.
-    
-    Your responses should be:
-    1. Accurate - based on industry best practices and technical service procedures
-    2. Practical - include specific diagnostic steps, tools needed, and repair procedures
-    3. Safety-focused - always mention safety precautions when relevant
-    4. Educational - explain why problems occur and how repairs resolve the root issue
+    if image_data or image_bytes:
+        return await advice()
+    model_name, prompt = _request_for(query, None)
+    return await _inflight.run(_cache.make_key(model_name, SYSTEM_INSTRUCTION, [prompt]), advice)
+
+async def get_repair_advice_stream(mechanic_id: str, query: str, image_data: str = None, image_bytes: Optional[bytes] = None) -> AsyncIterator[str]:
+    """
+    Streaming variant of get_repair_advice.
     
-    Use automotive terminology appropriate for professional mechanics. If the information provided is
-    insufficient for a definitive diagnosis, ask for specific symptoms, codes, or test results.
+    Returns:
+      - An async generator that yields parts of the advice as Gemini produces them.
+        A cached answer is yielded in one piece.
     """
+    # The key is read and the API configured once, when ai_integration.gemini is imported
+    if not GEMINI_API_KEY:
+        raise Exception("GEMINI_API_KEY environment variable not set.")
     
-    # Determine which model to use based on whether an image is provided
-    model_name = "gemini-1.5-flash" if not image_data else "gemini-1.5-pro"
+    # Image decoding and resizing are CPU-bound, so they run in a worker thread
+    model_name, contents = await asyncio.to_thread(_request_for, query, image_data, image_bytes)
     
-    # Check if an image was provided
-    if image_data:
-        try:
-            # Decode the base64 image
-            image_bytes = base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data)
-            image = PIL.Image.open(BytesIO(image_bytes))
-            
-            # Create a model with multimodal capabilities
-            model = genai.GenerativeModel(
-                model_name=model_name,
-                generation_config={
-                    "max_output_tokens": 800,
-                    "temperature": 0.2,
-                },
-                system_instruction=system_instruction
-            )
-            
-            # For multimodal input (text + image)
-            prompt = f"I need help with this automotive repair issue: {query}"
-            response = model.generate_content([prompt, image])
-        except Exception as e:
-            print(f"Error processing image: {e}")
-            # Fall back to text-only if image processing fails
-            model = genai.GenerativeModel(
-                model_name="gemini-1.5-flash",
-                generation_config={
-                    "max_output_tokens": 800,
-                    "temperature": 0.2,
-                },
-                system_instruction=system_instruction
-            )
-            response = model.generate_content(f"I need help with this automotive repair issue: {query}")
-    else:
-        # Text-only query
-        model = genai.GenerativeModel(
-            model_name="gemini-1.5-flash",
-            generation_config={
-                "max_output_tokens": 800,
-                "temperature": 0.2,
-            },
-            system_instruction=system_instruction
-        )
-        response = model.generate_content(f"I need help with this automotive repair issue: {query}")
+    # Text-only questions are answered from the cache when they were seen before
+    cacheable = isinstance(contents, str)
+    if cacheable:
+        cached = await _cache.aget(model_name, SYSTEM_INSTRUCTION, [contents])
+        if cached is not None:
+            yield cached
+            return
     
-    return response.text 
\ No newline at end of file
+    # Creating the context cache on first use is a blocking API call
+    model = await asyncio.to_thread(_repair_model, model_name)
+    response = await generate(model, contents, stream=True)
+    parts: List[str] = []
+    async for chunk in response:
+        if chunk.text:
+            parts.append(chunk.text)
+            yield chunk.text
+    # Only a complete answer is cached
+    if cacheable:
+        await _cache.aset(model_name, SYSTEM_INSTRUCTION, [contents], "".join(parts))
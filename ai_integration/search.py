@@ -1,22 +1,67 @@
 # backend/ai_integration/search.py
-import dotenv
-dotenv.load_dotenv()
-import os
-from supabase import create_client, Client
-from typing import List, Optional
+from ai_integration.db import get_async_client
+from ai_integration.profile import MECHANIC_PROFILE_FIELDS
+from ai_integration._inflight import InFlight
+from cachetools import TTLCache
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+import asyncio
+import heapq
+import logging
 import math
 import json
+import time
 
-# Get Supabase configuration from environment variables
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY") # Use ANON key
-if not SUPABASE_URL or not SUPABASE_ANON_KEY:
-    raise Exception("Supabase credentials (URL and ANON KEY) not set in environment variables.")
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-# Create Supabase client with proper authentication using ANON key
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+logger = logging.getLogger(__name__)
 
-def search_mechanics(
+# Results for popular searches barely change from one minute to the next. They are
+# served from memory for up to SEARCH_CACHE_TTL seconds; once older than
+# SEARCH_REFRESH_AFTER, the next hit still returns them but refreshes them in the
+# background (stale-while-revalidate), so callers rarely wait on Supabase
+SEARCH_CACHE_TTL = 60
+SEARCH_REFRESH_AFTER = 0.8 * SEARCH_CACHE_TTL
+_search_cache = TTLCache(maxsize=10_000, ttl=SEARCH_CACHE_TTL)
+_search_inflight = InFlight()
+_refresh_tasks: Set[asyncio.Task] = set()
+
+# Nearby-search coordinates are snapped to this many decimals (0.01 degree) before keying
+SNAP_DECIMALS = 2
+
+async def _load_search(key: Tuple, fetch: Callable[[], Awaitable[List[dict]]]) -> List[dict]:
+    results = await fetch()
+    _search_cache[key] = (results, time.monotonic())
+    return results
+
+async def _refresh_search(key: Tuple, fetch: Callable[[], Awaitable[List[dict]]]) -> None:
+    try:
+        await _search_inflight.run(str(key), lambda: _load_search(key, fetch))
+    except Exception as e:
+        # The stale entry keeps being served until it expires
+        logger.warning("Background search refresh failed: %s", e)
+
+async def _cached_search(key: Tuple, fetch: Callable[[], Awaitable[List[dict]]]) -> List[dict]:
+    """
+    Returns cached results for key, loading them with fetch() on a miss. Errors are
+    raised to the caller and never cached.
+    """
+    entry = _search_cache.get(key)
+    if entry is None:
+        # Concurrent misses for the same search share one query
+        return await _search_inflight.run(str(key), lambda: _load_search(key, fetch))
+    
+    results, loaded_at = entry
+    if time.monotonic() - loaded_at > SEARCH_REFRESH_AFTER:
+        task = asyncio.create_task(_refresh_search(key, fetch))
+        # Keep a reference so the task is not garbage-collected mid-refresh
+        _refresh_tasks.add(task)
+        task.add_done_callback(_refresh_tasks.discard)
+    return results
+
+async def search_mechanics(
     specialty: str = None,
     city: str = None,
     rating_min: float = None,
@@ -35,32 +80,48 @@ def search_mechanics(
     
     Returns a list of matching mechanic records.
     """
+    # Popular searches are served from the short-lived cache
+    key = ("search", specialty, city, rating_min, rating_max, page, limit)
     try:
-        query = supabase.table("mechanic_profiles").select("*")
-        
-        if specialty:
-            query = query.ilike("specialties", f"%{specialty}%")
-        if city:
-            query = query.ilike("city", f"%{city}%")
-        if rating_min is not None:
-            query = query.gte("rating", rating_min)
-        if rating_max is not None:
-            query = query.lte("rating", rating_max)
-        
-        # Calculate offset for pagination (assuming pages are 1-indexed).
-        offset = (page - 1) * limit
-        query = query.range(offset, offset + limit - 1)
-        
-        result = query.execute()
-        if result.error:
-            raise Exception(f"Search error: {result.error.message}")
-        
-        return result.data if result.data else []
+        return await _cached_search(
+            key, lambda: _query_mechanics(specialty, city, rating_min, rating_max, page, limit)
+        )
     except Exception as e:
-        print(f"Error in search_mechanics: {str(e)}")
+        logger.error("Error in search_mechanics: %s", e, exc_info=True)
         return []
 
-def nearby_mechanics(
+async def _query_mechanics(
+    specialty: Optional[str],
+    city: Optional[str],
+    rating_min: Optional[float],
+    rating_max: Optional[float],
+    page: int,
+    limit: int
+) -> List[dict]:
+    """Runs the search_mechanics query; raises on database errors."""
+    supabase = await get_async_client()
+    # Only the public profile columns, not every column of the table
+    query = supabase.table("mechanic_profiles").select(MECHANIC_PROFILE_FIELDS)
+    
+    if specialty:
+        # specialties is a text[]; its computed text column is trigram-indexed
+        query = query.ilike("specialties_text", f"%{specialty}%")
+    if city:
+        query = query.ilike("city", f"%{city}%")
+    if rating_min is not None:
+        query = query.gte("rating", rating_min)
+    if rating_max is not None:
+        query = query.lte("rating", rating_max)
+    
+    # Calculate offset for pagination (assuming pages are 1-indexed).
+    offset = (page - 1) * limit
+    query = query.range(offset, offset + limit - 1)
+    
+    # execute() raises on an HTTP error; zero matches is a normal, empty result
+    result = await query.execute()
+    return result.data or []
+
+async def nearby_mechanics(
     latitude: float,
     longitude: float,
     radius: float = 10.0,  # Default 10km radius
@@ -69,7 +130,7 @@ def nearby_mechanics(
 ) -> List[dict]:
     """
     Search for mechanics within a certain radius of given coordinates.
-    Uses the Haversine formula for distance calculation.
+    Distances are computed in Postgres by the 'nearby_mechanics' RPC (PostGIS).
     
     Parameters:
         latitude: User's latitude
@@ -79,84 +140,169 @@ def nearby_mechanics(
         limit: Maximum number of results to return
         
     Returns:
-        List of mechanics within the radius, sorted by distance
+        List of mechanics within the radius, sorted by distance. Coordinates are snapped
+        to a 0.01 degree (~1 km) grid so nearby callers share cached results.
     """
-    # First, get all mechanic profiles with lat/lng coordinates
+    # Snap the point so callers a few hundred meters apart share one cache entry
+    latitude = round(latitude, SNAP_DECIMALS)
+    longitude = round(longitude, SNAP_DECIMALS)
+    key = ("nearby", latitude, longitude, radius, specialty, limit)
     try:
-        print(f"Using Supabase URL: {SUPABASE_URL[:20]}... with key starting with: {SUPABASE_ANON_KEY[:10]}...")
-        
-        # Include users table to get full_name
-        # First attempt to get all mechanics and filter locally if the query is failing
-        query = supabase.table("mechanic_profiles").select("*,users(full_name,id,email)")
-        
-        # Execute the query
-        result = query.execute()
-        
-        # The execute() method raises an exception on error, so we don't need result.error
-        # If the code reaches here, the query was successful at the HTTP level.
-        
-        mechanics = result.data if result.data else []
-        print(f"Found {len(mechanics)} total mechanics in database")
-        
-        # Filter out entries with null coordinates locally
-        mechanics = [m for m in mechanics if m.get('current_latitude') is not None and m.get('current_longitude') is not None]
-        print(f"Found {len(mechanics)} mechanics with valid coordinates")
-        
-        # Filter by specialty if provided
-        if specialty:
-            mechanics = [m for m in mechanics if m.get('specialties') and specialty.lower() in str(m.get('specialties')).lower()]
-            print(f"Found {len(mechanics)} mechanics matching specialty: {specialty}")
+        return await _cached_search(
+            key, lambda: _query_nearby_mechanics(latitude, longitude, radius, specialty, limit)
+        )
+    except Exception as e:
+        logger.error("Error in nearby_mechanics: %s", e, exc_info=True)
+        # Return empty list on error, no mock data
+        return []
+
+async def _query_nearby_mechanics(
+    latitude: float,
+    longitude: float,
+    radius: float,
+    specialty: Optional[str],
+    limit: int
+) -> List[dict]:
+    """Runs the nearby search (RPC, then the Python fallback); raises on database errors."""
+    try:
+        # Radius filter, distance and ordering run in Postgres against the GiST index
+        # on mechanic_profiles.location (see supabase/migrations)
+        supabase = await get_async_client()
+        result = await supabase.rpc("nearby_mechanics", {
+            "p_lat": latitude,
+            "p_lng": longitude,
+            "p_radius_km": radius,
+            "p_specialty": specialty,
+            "p_limit": limit
+        }).execute()
+        return result.data if result.data else []
+    except Exception as e:
+        logger.warning("nearby_mechanics RPC failed, filtering in Python instead: %s", e)
+    
+    return await _scan_nearby_mechanics(latitude, longitude, radius, specialty, limit)
+
+# Earth radius in kilometers
+EARTH_RADIUS_KM = 6371.0
+
+# Most profiles the Python fallback will load for one search
+MAX_SCAN_ROWS = 1000
+
+def _bounding_box(latitude: float, longitude: float, radius: float) -> Tuple[float, float, Optional[float], Optional[float]]:
+    """
+    Returns (min_lat, max_lat, min_lng, max_lng) enclosing the search circle. The longitude
+    bounds are None when the box reaches a pole or crosses the antimeridian.
+    """
+    angular_radius = radius / EARTH_RADIUS_KM
+    dlat = math.degrees(angular_radius)
+    min_lat, max_lat = latitude - dlat, latitude + dlat
+    if min_lat <= -90 or max_lat >= 90:
+        return min_lat, max_lat, None, None
+    # The circle's widest longitude span (not simply radius / km-per-degree, which is
+    # slightly too narrow away from the equator)
+    dlng = math.degrees(math.asin(min(1.0, math.sin(angular_radius) / math.cos(math.radians(latitude)))))
+    min_lng, max_lng = longitude - dlng, longitude + dlng
+    if min_lng < -180 or max_lng > 180:
+        return min_lat, max_lat, None, None
+    return min_lat, max_lat, min_lng, max_lng
+
+def _haversine_km(latitude: float, longitude: float, mechanics: List[dict]) -> List[float]:
+    """Great-circle distance in km from (latitude, longitude) to each mechanic's coordinates."""
+    if np is not None:
+        # One vectorized pass instead of a dozen Python-level math calls per mechanic
+        coords = np.array(
+            [(float(m['current_latitude']), float(m['current_longitude'])) for m in mechanics],
+            dtype=np.float64
+        ).reshape(-1, 2)
+        lat1 = math.radians(latitude)
+        lat2 = np.radians(coords[:, 0])
+        dlat = lat2 - lat1
+        dlon = np.radians(coords[:, 1]) - math.radians(longitude)
+        a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+        # Rounding can push a a hair above 1 for antipodal points
+        return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))).tolist()
+    
+    # Without NumPy: the origin's terms are computed once, and 2*asin(sqrt(a)) saves
+    # the extra sqrt and atan2 of the atan2 form
+    lat1_rad = math.radians(latitude)
+    lon1_rad = math.radians(longitude)
+    cos_lat1 = math.cos(lat1_rad)
+    distances = []
+    for mechanic in mechanics:
+        lat2_rad = math.radians(float(mechanic['current_latitude']))
+        dlat = lat2_rad - lat1_rad
+        dlon = math.radians(float(mechanic['current_longitude'])) - lon1_rad
         
-        # Calculate distance for each mechanic using Haversine formula
-        nearby_results = []
-        for mechanic in mechanics:
-            # Get coordinates
-            mech_lat = float(mechanic['current_latitude'])
-            mech_lng = float(mechanic['current_longitude'])
-            
-            # Calculate distance using Haversine formula
-            # Earth radius in kilometers
-            R = 6371.0
-            
-            # Convert latitude and longitude from degrees to radians
-            lat1_rad = math.radians(latitude)
-            lon1_rad = math.radians(longitude)
-            lat2_rad = math.radians(mech_lat)
-            lon2_rad = math.radians(mech_lng)
-            
-            # Differences
-            dlon = lon2_rad - lon1_rad
-            dlat = lat2_rad - lat1_rad
-            
-            # Haversine formula
-            a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-            c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-            distance = R * c
-            
-            # Add distance to mechanic object
-            mechanic['distance'] = round(distance, 1)
-            
-            # Add user information
-            if mechanic.get('users'):
-                user_data = mechanic.pop('users')
-                if user_data:
-                    mechanic['full_name'] = user_data.get('full_name', 'Unknown')
-                    mechanic['email'] = user_data.get('email', '')
-            
-            # Only include mechanics within the radius
-            if distance <= radius:
-                nearby_results.append(mechanic)
+        # Haversine formula
+        a = math.sin(dlat * 0.5) ** 2 + cos_lat1 * math.cos(lat2_rad) * math.sin(dlon * 0.5) ** 2
+        distances.append(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0))))
+    return distances
+
+async def _scan_nearby_mechanics(
+    latitude: float,
+    longitude: float,
+    radius: float,
+    specialty: Optional[str],
+    limit: int
+) -> List[dict]:
+    """
+    Fallback for databases without the 'nearby_mechanics' function: loads every
+    mechanic profile and applies the Haversine formula in Python. Raises on database errors.
+    """
+    # First, get all mechanic profiles with lat/lng coordinates
+    supabase = await get_async_client()
+    
+    # Include users table to get full_name
+    # First attempt to get all mechanics and filter locally if the query is failing
+    query = supabase.table("mechanic_profiles").select(f"{MECHANIC_PROFILE_FIELDS},users(full_name,email)")
+    
+    # Filter by specialty in Postgres rather than downloading every profile first, on the
+    # same trigram-indexed text the RPC matches (specialties itself is a text[])
+    if specialty:
+        query = query.ilike("specialties_text", f"%{specialty}%")
+    
+    # Coarse bounding-box filter on the indexed coordinates; the exact Haversine
+    # distance below only runs on the rows inside the box
+    min_lat, max_lat, min_lng, max_lng = _bounding_box(latitude, longitude, radius)
+    query = query.gte("current_latitude", min_lat).lte("current_latitude", max_lat)
+    if min_lng is not None:
+        query = query.gte("current_longitude", min_lng).lte("current_longitude", max_lng)
+    
+    # Execute the query, capped so an unfiltered scan cannot pull the whole table
+    result = await query.limit(MAX_SCAN_ROWS).execute()
+    
+    # The execute() method raises an exception on error, so we don't need result.error
+    # If the code reaches here, the query was successful at the HTTP level.
+    
+    mechanics = result.data if result.data else []
+    if len(mechanics) == MAX_SCAN_ROWS:
+        logger.warning("Nearby scan hit the %d row cap; results may be incomplete", MAX_SCAN_ROWS)
+    logger.debug("Found %d mechanics in database (specialty: %s)", len(mechanics), specialty)
+    
+    # Filter out entries with null coordinates locally
+    mechanics = [m for m in mechanics if m.get('current_latitude') is not None and m.get('current_longitude') is not None]
+    logger.debug("Found %d mechanics with valid coordinates", len(mechanics))
+    
+    # Calculate distance for each mechanic using Haversine formula
+    distances = _haversine_km(latitude, longitude, mechanics)
+    nearby_results = []
+    for mechanic, distance in zip(mechanics, distances):
+        # Add distance to mechanic object
+        mechanic['distance'] = round(distance, 1)
         
-        # Sort results by distance
-        nearby_results.sort(key=lambda x: x['distance'])
-        print(f"Found {len(nearby_results)} mechanics within {radius}km radius")
+        # Add user information
+        if mechanic.get('users'):
+            user_data = mechanic.pop('users')
+            if user_data:
+                mechanic['full_name'] = user_data.get('full_name', 'Unknown')
+                mechanic['email'] = user_data.get('email', '')
         
-        # NO MOCK DATA - Return empty list if no real results
-        # Limit results
-        return nearby_results[:limit]
+        # Only include mechanics within the radius
+        if distance <= radius:
+            nearby_results.append(mechanic)
     
-    except Exception as e:
-        # This will catch errors during execute() or subsequent processing
-        print(f"Error in nearby_mechanics: {str(e)}")
-        # Return empty list on error, no mock data
-        return []
+    logger.debug("Found %d mechanics within %skm radius", len(nearby_results), radius)
+    
+    # NO MOCK DATA - Return empty list if no real results
+    # The nearest `limit` results, in distance order, without sorting the whole list
+    return heapq.nsmallest(limit, nearby_results, key=lambda x: x['distance'])
+
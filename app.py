@@ -1,32 +1,36 @@
 import os
+import time
+import asyncio
 import logging
-import dotenv
-dotenv.load_dotenv()
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Request, Depends, Body
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query, Request, Response, Depends, Body
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any, Union
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict
+from typing import Annotated, AsyncIterator, List, Optional, Dict, Any
 
 # Import AI integration modules
-from ai_integration.chatbot import get_chat_response
-from ai_integration.google_ai import analyze_image
-from ai_integration.admin_ai import get_admin_recommendations
-from ai_integration.mechanic_ai import get_mechanic_recommendations
-from ai_integration.repair_assistant import get_repair_advice
+from ai_integration.chatbot import get_chat_response, get_streaming_response_async
+from ai_integration.google_ai import analyze_image, analyze_image_stream
+from ai_integration.admin_ai import AdminInsights, get_admin_recommendations
+from ai_integration.mechanic_ai import get_mechanic_recommendations, get_mechanic_recommendations_stream
+from ai_integration.repair_assistant import get_repair_advice, get_repair_advice_stream
 from ai_integration.search import search_mechanics, nearby_mechanics
 from ai_integration.booking import create_booking, update_booking_status, get_booking_details
 from ai_integration.chatbot_booking import booking_chat_response
-from ai_integration.customer_support import get_support_response
+from ai_integration.customer_support import get_support_response, get_support_response_stream, validate_history
+from ai_integration.config import settings
+from ai_integration.db import close_async_client, get_async_client, warm_up_async_client
 from ai_integration.profile import (
     get_mechanic_profile, update_mechanic_profile,
-    get_customer_profile, update_customer_profile
+    get_customer_profile, update_customer_profile,
+    get_role_and_profile
 )
 
-# Configure logging
+# Configure logging (LOG_LEVEL=DEBUG enables the per-request booking traces)
 logging.basicConfig(
-    level=logging.INFO,
+    level=settings.log_level,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger("mobile-mechanics-api")
@@ -35,51 +39,181 @@ logger = logging.getLogger("mobile-mechanics-api")
 app = FastAPI(
     title="Mobile Mechanics API",
     description="API for Mobile Mechanics app with AI integration",
-    version="1.0.0"
+    version="1.0.0",
+    # orjson serializes the dict-heavy search, booking and profile replies several times
+    # faster than the stdlib json encoder
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware - essential for React Native app
+# Set ALLOWED_ORIGINS in production; finite method/header lists plus max_age let
+# clients cache the preflight for a day instead of sending OPTIONS before each call
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # Allow all origins - adjust in production
+    allow_origins=list(settings.allowed_origins),
     allow_credentials=True,
-    allow_methods=["*"],  # Allow all methods
-    allow_headers=["*"],  # Allow all headers
+    allow_methods=["GET", "POST", "PUT"],
+    allow_headers=["authorization", "content-type"],
+    max_age=86400,
 )
+if "*" in settings.allowed_origins:
+    # With credentials allowed, the wildcard lets any site call the API as the user
+    logger.warning("CORS allows every origin; set ALLOWED_ORIGINS to the app's origins outside development")
+
+class StreamAwareGZipMiddleware:
+    """
+    Gzips responses except the text streams, where the compressor would hold back
+    tokens until its buffer fills instead of forwarding each chunk as it arrives.
+    """
+
+    def __init__(self, app, **kwargs):
+        self.app = app
+        self.gzip = GZipMiddleware(app, **kwargs)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].endswith("/stream"):
+            await self.app(scope, receive, send)
+        else:
+            await self.gzip(scope, receive, send)
+
+# Search and profile lists compress several times over; tiny replies are not worth it
+app.add_middleware(StreamAwareGZipMiddleware, minimum_size=1024, compresslevel=5)
+
+# Room for the largest accepted image (MAX_UPLOAD_BYTES) base64-encoded in a JSON body,
+# plus multipart overhead
+MAX_REQUEST_BYTES = 12 * 1024 * 1024
+
+class MaxBodySizeMiddleware:
+    """
+    Caps request bodies before an endpoint parses them (Starlette spools a whole
+    multipart body before the endpoint runs): a declared Content-Length over the limit
+    gets a 413 straight away, and a body sent without one fails with a 413 once it
+    grows past the limit.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    def _too_large(self) -> HTTPException:
+        return HTTPException(status_code=413, detail=f"Request body too large (max {self.max_bytes // (1024 * 1024)} MB)")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            error = self._too_large()
+            await ORJSONResponse(status_code=error.status_code, content={"detail": error.detail})(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside body parsing, so FastAPI answers it like an endpoint error
+                    raise self._too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# Wraps the app, so the limit applies before any endpoint reads the body
+app.add_middleware(MaxBodySizeMiddleware, max_bytes=MAX_REQUEST_BYTES)
+
+# ---- Startup ----
+@app.on_event("startup")
+async def init_supabase():
+    """Create the shared async Supabase client before the first request"""
+    await get_async_client()
+    # Connect in the background so startup is not held up by the round trip
+    app.state.supabase_warmup = asyncio.create_task(warm_up_async_client())
+
+@app.on_event("shutdown")
+async def close_supabase():
+    """Release the pooled Supabase connections"""
+    await close_async_client()
 
 # ---- Error handling middleware ----
 @app.middleware("http")
 async def log_and_handle_exceptions(request: Request, call_next):
+    started = time.perf_counter()
     try:
         response = await call_next(request)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "%s %s -> %d in %.1f ms",
+                request.method, request.url.path, response.status_code,
+                (time.perf_counter() - started) * 1000
+            )
         return response
     except Exception as e:
-        logger.error(f"Unhandled exception: {str(e)}", exc_info=True)
-        return JSONResponse(
+        logger.error("Unhandled exception: %s", e, exc_info=True)
+        return ORJSONResponse(
             status_code=500,
             content={"detail": f"Internal server error: {str(e)}"}
         )
 
+# ---- Streaming responses ----
+async def _stream_response(chunks: AsyncIterator[str], label: str) -> StreamingResponse:
+    """
+    Starts a text stream once its first chunk is ready. Until then nothing has been sent,
+    so a failure (e.g. Gemini rejecting the call) still gets a 500 like the buffered
+    endpoints; once the body is streaming, a failure can only end it early, and is logged.
+    """
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except Exception as e:
+        logger.error("%s error: %s", label, e, exc_info=settings.debug_tracebacks)
+        raise HTTPException(status_code=500, detail=f"{label} error: {str(e)}")
+
+    async def body():
+        try:
+            if first is None:
+                return
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        except Exception as e:
+            logger.error("%s stream aborted: %s", label, e, exc_info=settings.debug_tracebacks)
+        finally:
+            await chunks.aclose()
+
+    return StreamingResponse(body(), media_type="text/plain")
+
 # ---- Health Check & Environment Info ----
+# The environment does not change while the process runs, so the health check reply
+# is built once instead of on every poll
+_ROOT_RESPONSE = {
+    "status": "online",
+    "app": "Mobile Mechanics API",
+    "environment": {
+        name: "✓ Set" if value else "✗ Missing"
+        for name, value in (
+            ("SUPABASE_URL", settings.supabase_url),
+            ("SUPABASE_ANON_KEY", settings.supabase_anon_key),
+            ("GEMINI_API_KEY", settings.gemini_api_key),
+        )
+    }
+}
+
 @app.get("/")
 async def root():
     """Health check endpoint that also returns environment info"""
-    env_status = {
-        "SUPABASE_URL": "✓ Set" if os.getenv("SUPABASE_URL") else "✗ Missing",
-        "SUPABASE_KEY": "✓ Set" if os.getenv("SUPABASE_KEY") else "✗ Missing",
-        "GEMINI_API_KEY": "✓ Set" if os.getenv("GEMINI_API_KEY") else "✗ Missing"
-    }
-    
-    return {
-        "status": "online",
-        "app": "Mobile Mechanics API",
-        "environment": env_status
-    }
+    return _ROOT_RESPONSE
 
 # ---- Chat Endpoint ----
 class ChatRequest(BaseModel):
     message: str
     conversation_history: Optional[List[str]] = None
+    session_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     response: str
@@ -88,47 +222,75 @@ class ChatResponse(BaseModel):
 async def chat_endpoint(chat_req: ChatRequest):
     """Process a chat message and return an AI response"""
     try:
-        logger.info(f"Chat request: {chat_req.message[:50]}...")
-        system_instruction = "You are an AI assistant for a mobile mechanic service. Answer concisely and accurately about car repairs, mechanic services, and related topics."
-        response_text = get_chat_response(chat_req.message, chat_req.conversation_history)
-        logger.info(f"Chat response generated: {len(response_text)} chars")
+        logger.info("Chat request: %s...", chat_req.message[:50])
+        response_text = await get_chat_response(chat_req.message, chat_req.conversation_history, chat_req.session_id)
         return ChatResponse(response=response_text)
     except Exception as e:
-        logger.error(f"Chat error: {str(e)}", exc_info=True)
+        logger.error("Chat error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Chat processing error: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(chat_req: ChatRequest):
+    """Process a chat message, streaming the AI response as it is generated"""
+    logger.info("Streaming chat request: %s...", chat_req.message[:50])
+    return await _stream_response(get_streaming_response_async(chat_req.message, chat_req.conversation_history), "Chat processing")
+
 # ---- Image Analysis Endpoint ----
+# Uploads are downscaled to 1024 px before reaching Gemini, so larger files only cost memory
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+
+def _check_upload_size(file: UploadFile) -> None:
+    """
+    Rejects an oversized image before it is decoded. By now Starlette has already spooled
+    the upload; MaxBodySizeMiddleware is what caps the request size itself.
+    """
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)")
+
+# Shared by the image analysis endpoints
+AnalysisAction = Annotated[str, Query(description="Type of analysis: caption or bbox")]
+ImageFile = Annotated[UploadFile, File()]
+
 @app.post("/analyze-image")
-async def analyze_image_endpoint(
-    action: str = Query("caption", description="Type of analysis: caption or bbox"),
-    file: UploadFile = File(...)
-):
+async def analyze_image_endpoint(file: ImageFile, action: AnalysisAction = "caption"):
     """Analyze an image using Google's Vision AI"""
+    _check_upload_size(file)
     try:
-        logger.info(f"Image analysis request: {action}")
-        file_content = await file.read()
-        result_text = analyze_image(file_content, action)
+        logger.info("Image analysis request: %s", action)
+        # Decode straight from the spooled upload instead of copying it into memory first
+        result_text = await analyze_image(file.file, action)
         return {"result": result_text}
     except Exception as e:
-        logger.error(f"Image analysis error: {str(e)}", exc_info=True)
+        logger.error("Image analysis error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Image analysis error: {str(e)}")
 
+@app.post("/analyze-image/stream")
+async def analyze_image_stream_endpoint(file: ImageFile, action: AnalysisAction = "caption"):
+    """Analyze an image, streaming the text as it is generated"""
+    _check_upload_size(file)
+    logger.info("Streaming image analysis request: %s", action)
+    # Decoded straight from the spooled upload, like /analyze-image: the image is prepared
+    # before the first chunk, which _stream_response awaits while the upload is still open
+    return await _stream_response(analyze_image_stream(file.file, action), "Image analysis")
+
 # ---- Admin AI Insights Endpoint ----
 class AdminInsightsRequest(BaseModel):
+    # Free-form on purpose: the dashboard sends whatever metrics it tracks and the prompt
+    # includes them all, so there is no fixed schema to validate against
     financial_data: Dict[str, Any]
 
 class AdminInsightsResponse(BaseModel):
-    insights: str
+    insights: AdminInsights
 
 @app.post("/admin-ai", response_model=AdminInsightsResponse)
 async def admin_ai_endpoint(req: AdminInsightsRequest):
     """Generate business insights for admin dashboard"""
     try:
         logger.info("Admin insights request received")
-        insights = get_admin_recommendations(req.financial_data)
+        insights = await get_admin_recommendations(req.financial_data)
         return AdminInsightsResponse(insights=insights)
     except Exception as e:
-        logger.error(f"Admin insights error: {str(e)}", exc_info=True)
+        logger.error("Admin insights error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Admin insights error: {str(e)}")
 
 # ---- Mechanic AI Assistant Endpoint ----
@@ -143,13 +305,19 @@ class MechanicAIResponse(BaseModel):
 async def mechanic_ai_endpoint(req: MechanicAIRequest):
     """Generate personalized business recommendations for mechanics"""
     try:
-        logger.info(f"Mechanic AI request for ID: {req.mechanic_id}")
-        recommendations = get_mechanic_recommendations(req.mechanic_id, req.message)
+        logger.info("Mechanic AI request for ID: %s", req.mechanic_id)
+        recommendations = await get_mechanic_recommendations(req.mechanic_id, req.message)
         return MechanicAIResponse(recommendations=recommendations)
     except Exception as e:
-        logger.error(f"Mechanic AI error: {str(e)}", exc_info=True)
+        logger.error("Mechanic AI error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Mechanic AI error: {str(e)}")
 
+@app.post("/mechanic-ai/stream")
+async def mechanic_ai_stream_endpoint(req: MechanicAIRequest):
+    """Stream personalized business recommendations for mechanics"""
+    logger.info("Streaming mechanic AI request for ID: %s", req.mechanic_id)
+    return await _stream_response(get_mechanic_recommendations_stream(req.mechanic_id, req.message), "Mechanic AI")
+
 # ---- Repair Assistant Endpoint ----
 class RepairAssistantRequest(BaseModel):
     mechanic_id: str
@@ -163,61 +331,124 @@ class RepairAssistantResponse(BaseModel):
 async def repair_assistant_endpoint(req: RepairAssistantRequest):
     """Get repair advice for mechanics"""
     try:
-        logger.info(f"Repair assistant request from mechanic ID: {req.mechanic_id}")
-        advice = get_repair_advice(req.mechanic_id, req.query, req.image_data)
+        logger.info("Repair assistant request from mechanic ID: %s", req.mechanic_id)
+        advice = await get_repair_advice(req.mechanic_id, req.query, req.image_data)
         return RepairAssistantResponse(advice=advice)
     except Exception as e:
-        logger.error(f"Repair assistant error: {str(e)}", exc_info=True)
+        logger.error("Repair assistant error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Repair assistant error: {str(e)}")
 
+@app.post("/repair-assistant/upload", response_model=RepairAssistantResponse)
+async def repair_assistant_upload_endpoint(
+    mechanic_id: str = Form(...),
+    query: str = Form(...),
+    file: Optional[UploadFile] = File(None)
+):
+    """Get repair advice for mechanics, with the photo sent as a multipart file instead of base64"""
+    if file:
+        _check_upload_size(file)
+    try:
+        logger.info("Repair assistant upload request from mechanic ID: %s", mechanic_id)
+        image_bytes = await file.read() if file else None
+        advice = await get_repair_advice(mechanic_id, query, image_bytes=image_bytes)
+        return RepairAssistantResponse(advice=advice)
+    except Exception as e:
+        logger.error("Repair assistant error: %s", e, exc_info=settings.debug_tracebacks)
+        raise HTTPException(status_code=500, detail=f"Repair assistant error: {str(e)}")
+
+@app.post("/repair-assistant/stream")
+async def repair_assistant_stream_endpoint(req: RepairAssistantRequest):
+    """Get repair advice for mechanics, streaming the text as it is generated"""
+    logger.info("Streaming repair assistant request from mechanic ID: %s", req.mechanic_id)
+    return await _stream_response(get_repair_advice_stream(req.mechanic_id, req.query, req.image_data), "Repair assistant")
+
 # ---- Mechanic Search Endpoint ----
+# Search results are cached server-side for a minute; let the app and any CDN reuse them too
+SEARCH_CACHE_CONTROL = "public, max-age=30, stale-while-revalidate=60"
+
+class SearchParams:
+    """Query parameters of /search-mechanics"""
+
+    def __init__(
+        self,
+        specialty: Annotated[Optional[str], Query(description="Filter mechanics by specialty")] = None,
+        city: Annotated[Optional[str], Query(description="Filter mechanics by city")] = None,
+        rating_min: Annotated[Optional[float], Query(description="Minimum customer rating")] = None,
+        rating_max: Annotated[Optional[float], Query(description="Maximum customer rating")] = None,
+        page: Annotated[int, Query(description="Page number for pagination")] = 1,
+        limit: Annotated[int, Query(description="Number of results per page")] = 10
+    ):
+        self.specialty = specialty
+        self.city = city
+        self.rating_min = rating_min
+        self.rating_max = rating_max
+        self.page = page
+        self.limit = limit
+
+class NearbyParams:
+    """Query parameters of /nearby-mechanics"""
+
+    def __init__(
+        self,
+        latitude: Annotated[float, Query(description="User's latitude")],
+        longitude: Annotated[float, Query(description="User's longitude")],
+        radius: Annotated[float, Query(description="Search radius in kilometers")] = 10.0,
+        specialty: Annotated[Optional[str], Query(description="Filter by specialty")] = None
+    ):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius
+        self.specialty = specialty
+
+SearchDep = Annotated[SearchParams, Depends()]
+NearbyDep = Annotated[NearbyParams, Depends()]
+
 @app.get("/search-mechanics")
-async def search_mechanics_endpoint(
-    specialty: Optional[str] = Query(None, description="Filter mechanics by specialty"),
-    city: Optional[str] = Query(None, description="Filter mechanics by city"),
-    rating_min: Optional[float] = Query(None, description="Minimum customer rating"),
-    rating_max: Optional[float] = Query(None, description="Maximum customer rating"),
-    page: int = Query(1, description="Page number for pagination"),
-    limit: int = Query(10, description="Number of results per page")
-):
+async def search_mechanics_endpoint(response: Response, p: SearchDep):
     """Search for mechanics based on criteria"""
     try:
-        logger.info(f"Search mechanics: city={city}, specialty={specialty}")
-        mechanics = search_mechanics(specialty, city, rating_min, rating_max, page, limit)
+        logger.info("Search mechanics: city=%s, specialty=%s", p.city, p.specialty)
+        mechanics = await search_mechanics(p.specialty, p.city, p.rating_min, p.rating_max, p.page, p.limit)
+        response.headers["Cache-Control"] = SEARCH_CACHE_CONTROL
         return {"data": mechanics}
     except Exception as e:
-        logger.error(f"Search mechanics error: {str(e)}", exc_info=True)
+        logger.error("Search mechanics error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
 
-# Add this new endpoint after the search-mechanics endpoint
 @app.get("/nearby-mechanics")
-async def nearby_mechanics_endpoint(
-    latitude: float = Query(..., description="User's latitude"),
-    longitude: float = Query(..., description="User's longitude"),
-    radius: float = Query(10.0, description="Search radius in kilometers"),
-    specialty: Optional[str] = Query(None, description="Filter by specialty")
-):
+async def nearby_mechanics_endpoint(response: Response, p: NearbyDep):
     """Search for mechanics near a given location"""
     try:
-        logger.info(f"Nearby mechanics search: lat={latitude}, lng={longitude}, radius={radius}km")
-        mechanics = nearby_mechanics(
-            latitude=latitude,
-            longitude=longitude,
-            radius=radius,
-            specialty=specialty
+        logger.info("Nearby mechanics search: lat=%s, lng=%s, radius=%skm", p.latitude, p.longitude, p.radius)
+        mechanics = await nearby_mechanics(
+            latitude=p.latitude,
+            longitude=p.longitude,
+            radius=p.radius,
+            specialty=p.specialty
         )
+        response.headers["Cache-Control"] = SEARCH_CACHE_CONTROL
         return {"mechanics": mechanics}
     except Exception as e:
-        logger.error(f"Nearby mechanics search error: {str(e)}", exc_info=True)
+        logger.error("Nearby mechanics search error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
 
 # ---- Booking Endpoints ----
+class PaymentInfo(BaseModel):
+    # process_payment is still a stub that reads none of these, so every field is optional
+    # and other keys clients already send are kept and passed through unchanged
+    model_config = ConfigDict(extra="allow")
+
+    method: Optional[str] = None  # e.g. "card" or "cash"
+    amount: Optional[float] = None
+    currency: Optional[str] = None
+    token: Optional[str] = None  # Card token from the payment provider
+
 class CreateBookingRequest(BaseModel):
     user_id: str
     mechanic_id: str
     booking_time: str  # ISO formatted datetime string
     service_duration: int  # in minutes
-    payment_info: Dict[str, Any]  # Payment details
+    payment_info: PaymentInfo
 
 class CreateBookingResponse(BaseModel):
     booking: Dict[str, Any]
@@ -226,17 +457,17 @@ class CreateBookingResponse(BaseModel):
 async def create_booking_endpoint(booking_req: CreateBookingRequest):
     """Create a new booking"""
     try:
-        logger.info(f"Create booking: user={booking_req.user_id}, mechanic={booking_req.mechanic_id}")
-        booking = create_booking(
+        logger.info("Create booking: user=%s, mechanic=%s", booking_req.user_id, booking_req.mechanic_id)
+        booking = await create_booking(
             user_id=booking_req.user_id,
             mechanic_id=booking_req.mechanic_id,
             booking_time=booking_req.booking_time,
             service_duration=booking_req.service_duration,
-            payment_info=booking_req.payment_info
+            payment_info=booking_req.payment_info.model_dump(exclude_none=True)
         )
         return CreateBookingResponse(booking=booking)
     except Exception as e:
-        logger.error(f"Create booking error: {str(e)}", exc_info=True)
+        logger.error("Create booking error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Booking creation error: {str(e)}")
 
 class UpdateBookingStatusRequest(BaseModel):
@@ -247,28 +478,29 @@ class UpdateBookingStatusRequest(BaseModel):
 async def update_booking_status_endpoint(req: UpdateBookingStatusRequest):
     """Update a booking's status"""
     try:
-        logger.info(f"Update booking status: id={req.booking_id}, status={req.new_status}")
-        updated_booking = update_booking_status(req.booking_id, req.new_status)
+        logger.info("Update booking status: id=%s, status=%s", req.booking_id, req.new_status)
+        updated_booking = await update_booking_status(req.booking_id, req.new_status)
         return {"booking": updated_booking}
     except Exception as e:
-        logger.error(f"Update booking status error: {str(e)}", exc_info=True)
+        logger.error("Update booking status error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Status update error: {str(e)}")
 
 @app.get("/get-booking/{booking_id}")
 async def get_booking_endpoint(booking_id: str):
     """Get details of a specific booking"""
     try:
-        logger.info(f"Get booking: id={booking_id}")
-        booking = get_booking_details(booking_id)
+        logger.info("Get booking: id=%s", booking_id)
+        booking = await get_booking_details(booking_id)
         return {"booking": booking}
     except Exception as e:
-        logger.error(f"Get booking error: {str(e)}", exc_info=True)
+        logger.error("Get booking error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Booking retrieval error: {str(e)}")
 
 # ---- Chatbot Booking Endpoint ----
 class BookingChatRequest(BaseModel):
     message: str
     conversation_history: Optional[List[str]] = None
+    session_id: Optional[str] = None
 
 class BookingChatResponse(BaseModel):
     response: str
@@ -277,11 +509,11 @@ class BookingChatResponse(BaseModel):
 async def chatbot_booking_endpoint(req: BookingChatRequest):
     """Process chat messages for booking-related inquiries"""
     try:
-        logger.info(f"Booking chat request: {req.message[:50]}...")
-        res_text = booking_chat_response(req.message, req.conversation_history)
+        logger.info("Booking chat request: %s...", req.message[:50])
+        res_text = await booking_chat_response(req.message, req.conversation_history, req.session_id)
         return BookingChatResponse(response=res_text)
     except Exception as e:
-        logger.error(f"Booking chat error: {str(e)}", exc_info=True)
+        logger.error("Booking chat error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Booking chat error: {str(e)}")
 
 # ---- Customer Support Endpoint ----
@@ -296,12 +528,25 @@ async def customer_support_endpoint(req: SupportChatRequest):
     """Process customer support conversations"""
     try:
         logger.info("Customer support request received")
-        res_text = get_support_response(req.conversation_history)
+        res_text = await get_support_response(req.conversation_history)
         return SupportChatResponse(response=res_text)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid conversation history: {str(e)}")
     except Exception as e:
-        logger.error(f"Customer support error: {str(e)}", exc_info=True)
+        logger.error("Customer support error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Support chat error: {str(e)}")
 
+@app.post("/customer-support/stream")
+async def customer_support_stream_endpoint(req: SupportChatRequest):
+    """Stream the customer support reply as it is generated"""
+    logger.info("Streaming customer support request received")
+    # Validated here: once the stream has started, a 400 can no longer be sent
+    try:
+        validate_history(req.conversation_history)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid conversation history: {str(e)}")
+    return await _stream_response(get_support_response_stream(req.conversation_history), "Support chat")
+
 # ---- Profile Endpoints ----
 class MechanicProfileUpdateRequest(BaseModel):
     mechanic_id: str
@@ -322,24 +567,24 @@ class MechanicProfileUpdateRequest(BaseModel):
 async def get_mechanic_profile_endpoint(mechanic_id: str):
     """Get a mechanic's profile"""
     try:
-        logger.info(f"Get mechanic profile: id={mechanic_id}")
-        profile = get_mechanic_profile(mechanic_id)
+        logger.info("Get mechanic profile: id=%s", mechanic_id)
+        profile = await get_mechanic_profile(mechanic_id)
         return {"profile": profile}
     except Exception as e:
-        logger.error(f"Get mechanic profile error: {str(e)}", exc_info=True)
+        logger.error("Get mechanic profile error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Profile retrieval error: {str(e)}")
 
 @app.put("/mechanic-profile")
 async def update_mechanic_profile_endpoint(req: MechanicProfileUpdateRequest):
     """Update a mechanic's profile"""
     try:
-        logger.info(f"Update mechanic profile: id={req.mechanic_id}")
+        logger.info("Update mechanic profile: id=%s", req.mechanic_id)
         # Convert to dict and exclude None values
-        update_data = {k: v for k, v in req.dict().items() if v is not None}
-        updated_profile = update_mechanic_profile(req.mechanic_id, update_data)
+        update_data = req.model_dump(exclude_none=True)
+        updated_profile = await update_mechanic_profile(req.mechanic_id, update_data)
         return {"profile": updated_profile}
     except Exception as e:
-        logger.error(f"Update mechanic profile error: {str(e)}", exc_info=True)
+        logger.error("Update mechanic profile error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Profile update error: {str(e)}")
 
 class CustomerProfileUpdateRequest(BaseModel):
@@ -352,55 +597,42 @@ class CustomerProfileUpdateRequest(BaseModel):
 async def get_customer_profile_endpoint(user_id: str):
     """Get a customer's profile"""
     try:
-        logger.info(f"Get customer profile: id={user_id}")
-        profile = get_customer_profile(user_id)
+        logger.info("Get customer profile: id=%s", user_id)
+        profile = await get_customer_profile(user_id)
         return {"profile": profile}
     except Exception as e:
-        logger.error(f"Get customer profile error: {str(e)}", exc_info=True)
+        logger.error("Get customer profile error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Profile retrieval error: {str(e)}")
 
 @app.put("/customer-profile")
 async def update_customer_profile_endpoint(req: CustomerProfileUpdateRequest):
     """Update a customer's profile"""
     try:
-        logger.info(f"Update customer profile: id={req.user_id}")
+        logger.info("Update customer profile: id=%s", req.user_id)
         # Convert to dict and exclude None values
-        update_data = {k: v for k, v in req.dict().items() if v is not None}
-        updated_profile = update_customer_profile(req.user_id, update_data)
+        update_data = req.model_dump(exclude_none=True)
+        updated_profile = await update_customer_profile(req.user_id, update_data)
         return {"profile": updated_profile}
     except Exception as e:
-        logger.error(f"Update customer profile error: {str(e)}", exc_info=True)
+        logger.error("Update customer profile error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Profile update error: {str(e)}")
 
-# Add this new endpoint after the customer profile endpoints
+# Role-agnostic profile lookup and update
 @app.get("/profile/{user_id}")
 async def get_user_profile_endpoint(user_id: str):
     """Get a user's profile based on their ID (works for both mechanics and customers)"""
     try:
-        logger.info(f"Get user profile: id={user_id}")
-        
-        # First try to check if this is a mechanic profile
-        try:
-            profile = get_mechanic_profile(user_id)
-            logger.info(f"Found mechanic profile for user {user_id}")
-            return {"profile": profile, "role": "mechanic"}
-        except Exception as mechanic_error:
-            logger.info(f"No mechanic profile found, trying customer profile: {str(mechanic_error)}")
-            
-            # If mechanic profile not found, try customer profile
-            try:
-                profile = get_customer_profile(user_id)
-                logger.info(f"Found customer profile for user {user_id}")
-                return {"profile": profile, "role": "customer"}
-            except Exception as customer_error:
-                logger.error(f"No profile found for user {user_id}: {str(customer_error)}")
-                raise HTTPException(status_code=404, detail=f"No profile found for user {user_id}")
-    
+        logger.info("Get user profile: id=%s", user_id)
+        found = await get_role_and_profile(user_id)
     except Exception as e:
-        logger.error(f"Get user profile error: {str(e)}", exc_info=True)
+        logger.error("Get user profile error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Profile retrieval error: {str(e)}")
+    
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"No profile found for user {user_id}")
+    role, profile = found
+    return {"profile": profile, "role": role}
 
-# Add this endpoint for updating profiles in a unified way
 @app.put("/profile")
 async def update_user_profile_endpoint(
     user_id: str = Body(..., description="The user ID to update"),
@@ -409,28 +641,34 @@ async def update_user_profile_endpoint(
 ):
     """Update a user's profile based on their role"""
     try:
-        logger.info(f"Update profile: id={user_id}, role={role}")
+        logger.info("Update profile: id=%s, role=%s", user_id, role)
         
         # Remove user_id from profile data since it's passed separately
         profile_data = {k: v for k, v in profile_data.items() if k != "user_id"}
         
         if role.lower() == "mechanic":
-            updated_profile = update_mechanic_profile(user_id, profile_data)
+            updated_profile = await update_mechanic_profile(user_id, profile_data)
             return {"profile": updated_profile, "role": "mechanic"}
         
         elif role.lower() == "customer":
-            updated_profile = update_customer_profile(user_id, profile_data)
+            updated_profile = await update_customer_profile(user_id, profile_data)
             return {"profile": updated_profile, "role": "customer"}
         
         else:
             raise HTTPException(status_code=400, detail=f"Invalid role: {role}")
             
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Update profile error: {str(e)}", exc_info=True)
+        logger.error("Update profile error: %s", e, exc_info=settings.debug_tracebacks)
         raise HTTPException(status_code=500, detail=f"Profile update error: {str(e)}")
 
-# Server startup for local development
+# Direct startup (production runs under gunicorn, see Procfile). The reloader watches
+# files and forces a single worker, so it is only enabled with ENV=dev
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run("app:app", host="0.0.0.0", port=port, reload=True)
+    if os.environ.get("ENV") == "dev":
+        uvicorn.run("app:app", host="0.0.0.0", port=port, reload=True)
+    else:
+        uvicorn.run("app:app", host="0.0.0.0", port=port, workers=int(os.environ.get("WEB_CONCURRENCY", 2)))
@@ -0,0 +1,21 @@
+-- Server-side overlap check for booking availability.
+-- Returns true when the mechanic already has an active booking that overlaps [p_start, p_end).
+create or replace function check_overlap(p_mechanic_id uuid, p_start timestamptz, p_end timestamptz)
+returns boolean
+language sql
+stable
+as $$
+  select exists (
+    select 1
+    from bookings
+    where mechanic_id = p_mechanic_id
+      and status not in ('cancelled', 'completed')
+      and booking_time < p_end
+      and booking_time + make_interval(mins => service_duration) > p_start
+  );
+$$;
+
+-- Only active bookings take part in overlap checks, so index just those.
+create index if not exists bookings_mechanic_active_time_idx
+  on bookings (mechanic_id, booking_time)
+  where status not in ('cancelled', 'completed');
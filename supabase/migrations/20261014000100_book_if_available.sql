@@ -0,0 +1,48 @@
+-- Atomic "check availability and insert" for create_booking.
+
+create extension if not exists btree_gist;
+
+-- Minute-based intervals are unaffected by time zones, so this is safe to mark immutable
+-- (timestamptz + interval is only stable, which an exclusion constraint does not accept).
+create or replace function booking_range(p_start timestamptz, p_duration integer)
+returns tstzrange
+language sql
+immutable
+as $$
+  select tstzrange(p_start, p_start + make_interval(mins => p_duration));
+$$;
+
+-- Two active bookings for the same mechanic may never overlap.
+-- Postgres has no "add constraint if not exists", so check the catalog to keep the
+-- migration replayable.
+do $$
+begin
+  if not exists (
+    select 1 from pg_constraint
+    where conname = 'bookings_no_overlap' and conrelid = 'bookings'::regclass
+  ) then
+    alter table bookings
+      add constraint bookings_no_overlap
+      exclude using gist (
+        mechanic_id with =,
+        booking_range(booking_time, service_duration) with &&
+      )
+      where (status not in ('cancelled', 'completed'));
+  end if;
+end
+$$;
+
+-- Inserts the booking, or fails with exclusion_violation (23P01) if the slot is taken.
+create or replace function book_if_available(
+  p_user_id uuid,
+  p_mechanic_id uuid,
+  p_start timestamptz,
+  p_duration integer
+)
+returns setof bookings
+language sql
+as $$
+  insert into bookings (user_id, mechanic_id, booking_time, service_duration, status, created_at)
+  values (p_user_id, p_mechanic_id, p_start, p_duration, 'pending', now())
+  returning *;
+$$;
@@ -0,0 +1,75 @@
+-- Server-side radius search for mechanics.
+-- A generated geography column (kept in sync with current_latitude / current_longitude)
+-- backed by a GiST index lets ST_DWithin and the <-> ordering use the index instead of
+-- shipping every profile to the API for a Haversine scan.
+create extension if not exists postgis;
+
+-- Searchable text of a specialties array. array_to_string is only stable, so this
+-- wrapper is declared immutable to allow an expression index on it (see the
+-- specialties_trgm migration); the RPC and the API fallback both filter on it.
+create or replace function mechanic_specialties_text(p_specialties text[])
+returns text
+language sql
+immutable
+parallel safe
+as $$
+  select coalesce(array_to_string(p_specialties, ' '), '');
+$$;
+
+alter table mechanic_profiles
+  add column if not exists location geography(Point, 4326)
+  generated always as (
+    case
+      when current_latitude is not null and current_longitude is not null
+        then st_setsrid(st_makepoint(current_longitude, current_latitude), 4326)::geography
+    end
+  ) stored;
+
+create index if not exists mechanic_profiles_location_gix
+  on mechanic_profiles using gist (location);
+
+-- Returns the matching profiles as JSON, nearest first: the public profile columns (keep
+-- in sync with MECHANIC_PROFILE_FIELDS in ai_integration/profile.py), the distance in km
+-- (one decimal) and the owner's full_name / email, i.e. the same shape as the Python fallback.
+create or replace function nearby_mechanics(
+  p_lat float8,
+  p_lng float8,
+  p_radius_km float8,
+  p_specialty text default null,
+  p_limit int default 20
+)
+returns setof jsonb
+language sql
+stable
+as $$
+  with origin as (
+    select st_setsrid(st_makepoint(p_lng, p_lat), 4326)::geography as point
+  )
+  select jsonb_build_object(
+           'id', mp.id,
+           'user_id', mp.user_id,
+           'bio', mp.bio,
+           'years_experience', mp.years_experience,
+           'hourly_rate', mp.hourly_rate,
+           'is_mobile', mp.is_mobile,
+           'specialties', mp.specialties,
+           'city', mp.city,
+           'current_latitude', mp.current_latitude,
+           'current_longitude', mp.current_longitude,
+           'available_now', mp.available_now,
+           'languages', mp.languages,
+           'certifications', mp.certifications,
+           'portfolio_urls', mp.portfolio_urls,
+           'rating', mp.rating,
+           'distance', round((st_distance(mp.location, origin.point) / 1000)::numeric, 1),
+           'full_name', coalesce(u.full_name, 'Unknown'),
+           'email', coalesce(u.email, '')
+         )
+  from mechanic_profiles mp
+  cross join origin
+  left join users u on u.id = mp.user_id
+  where st_dwithin(mp.location, origin.point, p_radius_km * 1000)
+    and (p_specialty is null or mechanic_specialties_text(mp.specialties) ilike '%' || p_specialty || '%')
+  order by mp.location <-> origin.point
+  limit p_limit;
+$$;
@@ -0,0 +1,21 @@
+-- Trigram index for the specialty filter.
+-- specialties is a text[] column, which has no trigram operator class, so the index is
+-- built on mechanic_specialties_text(specialties) (defined with the nearby_mechanics
+-- RPC). search_mechanics and the nearby-mechanics fallback filter that same expression
+-- with ILIKE '%...%' through the specialties_text computed column below; a leading
+-- wildcard cannot use a btree index, so without this every such query scans the table.
+create extension if not exists pg_trgm;
+
+-- PostgREST exposes a function over the row type as a filterable computed column
+-- (?specialties_text=ilike.*...*). The SQL body is inlined, so the planner sees the
+-- indexed expression.
+create or replace function specialties_text(mechanic_profiles)
+returns text
+language sql
+immutable
+as $$
+  select mechanic_specialties_text($1.specialties);
+$$;
+
+create index if not exists mechanic_profiles_specialties_text_trgm
+  on mechanic_profiles using gin (mechanic_specialties_text(specialties) gin_trgm_ops);
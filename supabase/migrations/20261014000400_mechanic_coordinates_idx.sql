@@ -0,0 +1,5 @@
+-- Btree index for the bounding-box pre-filter of the nearby-mechanics fallback scan
+-- (current_latitude / current_longitude range conditions) on databases where the
+-- PostGIS nearby_mechanics function is not installed.
+create index if not exists mechanic_profiles_coordinates_idx
+  on mechanic_profiles (current_latitude, current_longitude);